@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException, Query
+from datetime import datetime
 from app.services.action_logs import list_all_action_logs
 from app.services.action_logs import search_log_by_id
+from app.services.log_writer import log_writer
 from app.models.type import LogsStatus, LogsActionType
 router = APIRouter()
 
@@ -11,18 +13,36 @@ async def get_all_logs(
         action_type: LogsActionType | None = None,
         resource_type: str | None = None,
         status: LogsStatus | None = None,
+        start_time: datetime | None = None,
+        end_time: datetime | None = None,
+        cursor: str | None = None,
+        keyset: bool = False,
     ):
     """
     Get logs with pagination and optional filters.
     Example: /logs?skip=0&limit=20&action_type=chat
+    Keyset pagination: /logs?keyset=true&limit=20, then /logs?cursor={next_cursor}&limit=20
+    Time range: /logs?start_time=2025-01-01T00:00:00Z&end_time=2025-01-02T00:00:00Z
     """
     log = await list_all_action_logs(skip=skip,
                                      limit=limit,
                                      action_type=action_type.value if action_type else None,
                                      resource_type=resource_type,
-                                     status=status.value if status else None)
+                                     status=status.value if status else None,
+                                     start_time=start_time,
+                                     end_time=end_time,
+                                     cursor=cursor,
+                                     keyset=keyset)
     return log
 
+@router.get("/writer/stats")
+async def get_log_writer_stats():
+    """
+    Background log writer metrics: queue depth, dropped and failed records.
+    Example: /logs/writer/stats
+    """
+    return log_writer.stats()
+
 @router.get("/{log_id}")
 async def get_log_by_id(log_id: str):
     """
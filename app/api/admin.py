@@ -0,0 +1,28 @@
+from fastapi import APIRouter
+from app.services.vector_index import vector_index_health, update_recall, index_maintainer
+router = APIRouter()
+
+@router.get("/vector-index")
+async def get_vector_index_health():
+    """
+    ANN index health: size, lists, rows now vs at build, growth/drift since the build,
+    estimated recall and whether a rebuild is pending.
+    Example: /admin/vector-index
+    """
+    return await vector_index_health()
+
+@router.post("/vector-index/maintain", status_code=202)
+async def maintain_vector_index(rebuild: bool = False):
+    """
+    Run index maintenance (ANALYZE, build/rebuild if stale) now in the background.
+    `rebuild=true` rebuilds the index whatever its state. Progress: GET /admin/vector-index
+    """
+    index_maintainer.wake(force_rebuild=rebuild)
+    return {"scheduled": True, "rebuild": rebuild}
+
+@router.post("/vector-index/recall")
+async def measure_vector_index_recall():
+    """
+    Estimate recall@VECTOR_RECALL_K of the ANN search against an exact scan, and store it.
+    """
+    return {"recall": await update_recall()}
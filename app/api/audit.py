@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Query
+from datetime import datetime
 from app.services.audit import list_audit_logs, search_audit_by_id
 
 router = APIRouter()
@@ -17,9 +18,19 @@ async def get_audit_by_id_route(chat_id: str):
 @router.get("/")
 async def get_all_audits(
         skip: int = Query(0, ge=0),
-        limit: int = Query(50, ge=10, le=100)):
+        limit: int = Query(50, ge=10, le=100),
+        start_time: datetime | None = None,
+        end_time: datetime | None = None,
+        cursor: str | None = None,
+        keyset: bool = False):
     """
     Get all logs which AI interaction.
     Example: /audit?skip=0&limit=20
+    Keyset pagination: /audit?keyset=true&limit=20, then /audit?cursor={next_cursor}&limit=20
     """
-    return await list_audit_logs(limit=limit, skip=skip)
\ No newline at end of file
+    return await list_audit_logs(limit=limit,
+                                 skip=skip,
+                                 start_time=start_time,
+                                 end_time=end_time,
+                                 cursor=cursor,
+                                 keyset=keyset)
\ No newline at end of file
@@ -1,17 +1,45 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import StreamingResponse
-from app.services.chat import handle_chat
+from app.services.chat import handle_chat, retrieval_options
+from app.services.checkpointer import checkpointer_stats
 
 router = APIRouter()
 
 @router.post("")
 async def chat_stream(request: Request):
     """
-    Using request to chat realtime:
+    Using request to chat realtime, answer is streamed as Server-Sent Events:
     Input example:
-    {"text": "Tell me about AI", enable_reasoning: true(default=false)}
+    {"query": "Tell me about AI", enable_reasoning: true(default=false), stream_reasoning: true(default=false)}
+    Optional retrieval settings (defaults from env):
+    {"retrieval_mode": "vector" | "lexical" | "hybrid", "vector_k": 20, "lexical_k": 20,
+     "vector_weight": 1.0, "lexical_weight": 1.0,
+     "filters": {"tenant": "acme", "tags": ["billing", "faq"], "filename": "manual.pdf"}}
+    Events: `token`, `reasoning` (only with stream_reasoning), `done`, `error`
     """
     data = await request.json()
-    generator = await handle_chat(data["query"], enable_reasoning=data.get("enable_reasoning", False))
-    return StreamingResponse(generator, media_type="text/event-stream")
+    try:
+        retrieval = retrieval_options(
+            mode=data.get("retrieval_mode"),
+            vector_k=data.get("vector_k"),
+            lexical_k=data.get("lexical_k"),
+            vector_weight=data.get("vector_weight"),
+            lexical_weight=data.get("lexical_weight"),
+            filters=data.get("filters")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    generator = await handle_chat(data["query"],
+                                  enable_reasoning=data.get("enable_reasoning", False),
+                                  stream_reasoning=data.get("stream_reasoning", False),
+                                  retrieval=retrieval)
+    return StreamingResponse(generator,
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
+@router.get("/checkpointer/stats")
+async def get_checkpointer_stats():
+    """
+    Chat graph checkpoint store: threads kept, evictions and approximate payload size (memory mode)
+    """
+    return checkpointer_stats()
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.services.warmup import readiness
+router = APIRouter()
+
+@router.get("/live")
+async def live():
+    """
+    Liveness: the process is up and serving. Never touches the database.
+    """
+    return {"status": "alive"}
+
+@router.get("/ready")
+async def ready():
+    """
+    Readiness: 200 once warm-up is done and the database answers, 503 before that.
+    """
+    is_ready, details = await readiness()
+    content = {"status": "ready" if is_ready else "not_ready", **details}
+    return JSONResponse(status_code=200 if is_ready else 503, content=jsonable_encoder(content))
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, UploadFile, File, Form, Query
+from app.services.ingestion_jobs import (
+    submit_upload_job, submit_update_job, get_job, list_jobs, cancel_job, resume_job
+)
+
+router = APIRouter()
+
+@router.post("/upload", status_code=202)
+async def create_upload_job(file: UploadFile = File(...), source: str | None = Form(None)):
+    """
+    Queue a file for chunking and embedding, returns the job right away.
+    File supported: .pdf, .md, .txt
+    Like /knowledge/upload, the job replaces the chunk set of `source` (default: the file name).
+    """
+    return await submit_upload_job(file, source)
+
+@router.post("/update", status_code=202)
+async def create_update_job(docs: list[dict]):
+    """
+    Queue a bulk Create/Update, same body as /knowledge/update.
+    Example: [{"id": "uuid1", "text": "abc"}]
+    """
+    return await submit_update_job(docs)
+
+@router.get("")
+async def get_jobs(status: str | None = None, limit: int = Query(50, ge=1, le=500)):
+    """
+    List ingestion jobs, newest first.
+    Example: /jobs?status=running
+    """
+    return await list_jobs(status=status, limit=limit)
+
+@router.get("/{job_id}")
+async def get_job_by_id(job_id: str):
+    """
+    Progress, per-chunk failures and throughput of a job
+    """
+    return await get_job(job_id)
+
+@router.post("/{job_id}/cancel")
+async def cancel_job_by_id(job_id: str):
+    return await cancel_job(job_id)
+
+@router.post("/{job_id}/resume")
+async def resume_job_by_id(job_id: str):
+    """
+    Requeue a failed or cancelled job; it continues after the last processed chunk
+    """
+    return await resume_job(job_id)
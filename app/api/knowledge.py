@@ -1,7 +1,12 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
 import uuid
-from app.services.vector_store import upsert_docs, delete_doc, list_docs, search_knowledge_by_id
-from app.services.file_extractor import extract_text
+from app.services.vector_store import (
+    upsert_docs, sync_source, delete_doc, delete_source, list_docs, stream_docs, search_knowledge_by_id,
+    search_knowledge, search_batch, validate_filters, validate_search_params, RETRIEVAL_MODES, SEARCH_MAX_QUERIES
+)
+from app.services.file_extractor import iter_documents
+import asyncio
 import shutil
 import tempfile
 import os
@@ -17,16 +22,73 @@ async def update_knowledge(docs: list[dict]):
     """
     return await upsert_docs(docs)
 
+@router.post("/search")
+async def search(body: dict):
+    """
+    Top-k chunks for one or many queries, without calling the LLM.
+    Example:
+    {"query": "error E1042", "k": 5, "min_sim_score": 0.3, "mode": "vector" | "lexical" | "hybrid",
+     "filters": {"tenant": "acme", "tags": ["billing", "faq"], "filename": "manual.pdf"}}
+    -> [{"id": ..., "content": ..., "similarity": ...}, ...]
+    Batch: {"queries": ["q1", "q2"], "k": 5, "include_content": false}
+    -> {"results": [{"query": "q1", "hits": [...]}, ...], "latency_ms": 42}
+    k is 1..SEARCH_MAX_K, min_sim_score -1..1; include_content=false drops `content` in both shapes.
+    A list filter value matches any of its values; different keys must all match.
+    """
+    queries = body.get("queries")
+    if not body.get("query") and not queries:
+        raise HTTPException(status_code=400, detail="'query' or 'queries' is required")
+    if queries is not None and (not isinstance(queries, list) or not all(isinstance(q, str) and q for q in queries)):
+        raise HTTPException(status_code=400, detail="'queries' must be a list of non-empty strings")
+    if queries and len(queries) > SEARCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {SEARCH_MAX_QUERIES} queries per request")
+    mode = body.get("mode", "vector")
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {RETRIEVAL_MODES}")
+    include_content = body.get("include_content", True)
+    if not isinstance(include_content, bool):
+        raise HTTPException(status_code=400, detail="include_content must be a boolean")
+    try:
+        filters = validate_filters(body.get("filters"))
+        k, min_sim_score = validate_search_params(body.get("k", 3), body.get("min_sim_score", 0.5))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if queries:
+        return await search_batch(queries, k=k, min_sim_score=min_sim_score, filters=filters,
+                                  mode=mode, include_content=include_content)
+    hits = await search_knowledge(body["query"], k=k, min_sim_score=min_sim_score, filters=filters, mode=mode)
+    if include_content or isinstance(hits, dict):
+        return hits
+    return [{key: value for key, value in hit.items() if key != "content"} for hit in hits]
+
+@router.delete("")
+async def delete_knowledge_by_source(source: str = Query(..., min_length=1)):
+    """
+    Delete every chunk of a source (uploaded file name by default)
+    Example: DELETE /knowledge?source=manual.pdf
+    """
+    return await delete_source(source)
+
 @router.delete("/{doc_id}")
 async def delete_knowledge(doc_id: str):
     return await delete_doc(doc_id)
 
 @router.get("")
-async def get_knowledge():
+async def get_knowledge(limit: int | None = Query(None, ge=1, le=1000),
+                        cursor: str | None = None,
+                        keyset: bool = False,
+                        include_content: bool = True,
+                        format: str = Query("json", pattern="^(json|ndjson)$")):
     """
-    Get all knowledge
+    Get all knowledge, newest first
+    Keyset pagination: /knowledge?keyset=true&limit=100, then /knowledge?cursor={next_cursor}&limit=100
+    Full export without buffering: /knowledge?format=ndjson (one JSON document per line)
+    include_content=false returns only id, created_at and size
     """
-    return await list_docs()
+    if format == "ndjson":
+        return StreamingResponse(stream_docs(include_content=include_content), media_type="application/x-ndjson")
+    return await list_docs(limit=limit, cursor=cursor, keyset=keyset, include_content=include_content)
 
 @router.get("/{knowledge_id}")
 async def get_knowledge_by_id(knowledge_id):
@@ -36,18 +98,21 @@ async def get_knowledge_by_id(knowledge_id):
     return await search_knowledge_by_id(knowledge_id=knowledge_id)
 
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), source: str | None = Form(None)):
     """
     Upload, chunking and embedding into vector database.
     File supported: .pdf, .md, .txt
+    Re-uploading a source (default: the file name) replaces its chunk set in one transaction:
+    only new or changed chunks are written and chunks no longer in the file are deleted.
     """
     file_ext = os.path.splitext(file.filename)[-1].lower()
 
     with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-        shutil.copyfileobj(file.file, tmp)
+        await asyncio.to_thread(shutil.copyfileobj, file.file, tmp)
         tmp_path = tmp.name
 
-    docs = await extract_text(file_path=tmp_path, file_ext=file_ext, file_name=file.filename)
-    
-    os.remove(tmp_path)
-    return await upsert_docs(docs)
+    try:
+        docs = iter_documents(file_path=tmp_path, file_ext=file_ext, file_name=file.filename)
+        return await sync_source(source or file.filename, docs)
+    finally:
+        os.remove(tmp_path)
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.services.metrics import metrics_text
+router = APIRouter()
+
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Metrics of this worker in the Prometheus text format: per-stage latency histograms,
+    cache hits, connection pool, read routing, log writer and in-flight HTTP requests.
+    """
+    return PlainTextResponse(metrics_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,16 +1,238 @@
 import os
+import time
+from contextvars import ContextVar
+from sqlalchemy import event, text
+from sqlalchemy.sql.elements import TextClause
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import sessionmaker, Session
 from contextlib import asynccontextmanager
+from loguru import logger
 
 DATABASE_URL = os.getenv("DB_URL")
 
-engine = create_async_engine(DATABASE_URL, echo=False)
-AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+# asyncpg prepares and caches every statement per connection; set 0 behind pgbouncer in transaction mode
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", 100))
 
+def _connect_args() -> dict:
+    args = {"prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE}
+    if DB_STATEMENT_TIMEOUT_MS:
+        args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    return args
+
+# Optional streaming replica for read-only queries, see get_read_session
+DB_READ_URL = os.getenv("DB_READ_URL")
+DB_READ_LAG_WINDOW = float(os.getenv("DB_READ_LAG_WINDOW", 5))
+DB_READ_MAX_LAG_MS = int(os.getenv("DB_READ_MAX_LAG_MS", 0))
+DB_READ_LAG_CHECK_INTERVAL = float(os.getenv("DB_READ_LAG_CHECK_INTERVAL", 5))
+DB_READ_RETRY_AFTER = float(os.getenv("DB_READ_RETRY_AFTER", 30))
+
+def _create_engine(url: str):
+    return create_async_engine(
+        url,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=_connect_args(),
+    )
+
+
+class PrimarySession(Session):
+    """Sync session class of the primary; remembers when each table was last written (see _recent_writes)."""
+
+engine = _create_engine(DATABASE_URL)
+AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, sync_session_class=PrimarySession, expire_on_commit=False)
+
+# Schema migrations, index builds, ANALYZE and recall scans: no DB_STATEMENT_TIMEOUT_MS, which would
+# cancel long builds (leaving an INVALID index behind), and no pool since they run rarely
+maintenance_engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    poolclass=NullPool,
+    connect_args={**_connect_args(), "server_settings": {"statement_timeout": "0"}},
+)
+
+read_engine = _create_engine(DB_READ_URL) if DB_READ_URL else None
+ReadSessionLocal = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False) if read_engine else None
+
+# {table: monotonic time of the last commit that wrote it}; "*" for raw SQL writes of unknown tables
+_recent_writes: dict[str, float] = {}
+_replica = {"down_until": 0.0, "lag_ms": None, "lag_checked_at": 0.0}
+_read_stats = {"replica": 0, "primary": 0, "fallbacks": 0, "lag_guarded": 0}
+
+@event.listens_for(PrimarySession, "do_orm_execute")
+def _track_statement_writes(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        state.session.info.setdefault("written_tables", set()).add(getattr(table, "name", "*"))
+    elif isinstance(state.statement, TextClause):
+        words = state.statement.text.split(None, 1)
+        if words and words[0].upper() in ("INSERT", "UPDATE", "DELETE"):
+            state.session.info.setdefault("written_tables", set()).add("*")
+
+@event.listens_for(PrimarySession, "after_flush")
+def _track_flush_writes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        session.info.setdefault("written_tables", set()).add(obj.__table__.name)
+
+@event.listens_for(PrimarySession, "after_commit")
+def _record_writes(session):
+    now = time.monotonic()
+    for table in session.info.pop("written_tables", ()):
+        _recent_writes[table] = now
+
+@event.listens_for(PrimarySession, "after_rollback")
+def _forget_writes(session):
+    session.info.pop("written_tables", None)
+
+
+class RequestScope:
+    """
+    One session shared by the sequential get_session() calls of a request (see
+    RequestSessionMiddleware). The connection is only held while a caller uses the
+    session, so a long streamed response does not pin a pooled connection.
+    """
+
+    def __init__(self):
+        self.session: AsyncSession | None = None
+        self.in_use = False
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+_request_scope: ContextVar[RequestScope | None] = ContextVar("request_scope", default=None)
+
+@asynccontextmanager
+async def request_scope():
+    scope = RequestScope()
+    token = _request_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _request_scope.reset(token)
+        await scope.close()
 
 @asynccontextmanager
-async def get_session() -> AsyncSession:
-    async with AsyncSessionLocal() as session:
+async def get_session(isolated: bool = False) -> AsyncSession:
+    """
+    Session for one unit of work. Inside a request the request's shared session is reused;
+    `isolated=True` (background workers, concurrent work) or a shared session already
+    in use (asyncio.gather legs, nested calls) gets a session of its own.
+    """
+    scope = _request_scope.get()
+    if isolated or scope is None or scope.in_use:
+        async with AsyncSessionLocal() as session:
+            yield session
+        return
+
+    if scope.session is None:
+        scope.session = AsyncSessionLocal()
+    scope.in_use = True
+    try:
+        yield scope.session
+    finally:
+        # Same end state as closing a private session: uncommitted work is rolled back,
+        # loaded objects are detached and the connection goes back to the pool
+        try:
+            scope.session.expunge_all()
+            await scope.session.rollback()
+        finally:
+            scope.in_use = False
+
+
+async def _replica_lag_ms() -> float | None:
+    """Replay lag of the replica, measured at most every DB_READ_LAG_CHECK_INTERVAL seconds."""
+    now = time.monotonic()
+    if now - _replica["lag_checked_at"] < DB_READ_LAG_CHECK_INTERVAL:
+        return _replica["lag_ms"]
+    _replica["lag_checked_at"] = now
+    async with read_engine.connect() as conn:
+        # Caught up with everything received: no lag, however long ago the last transaction was
+        result = await conn.execute(text("""
+            SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) * 1000 END
+        """))
+        lag = result.scalar()
+    _replica["lag_ms"] = float(lag) if lag is not None else None
+    return _replica["lag_ms"]
+
+async def _use_replica(tables: tuple[str, ...], replica: bool | None) -> bool:
+    if read_engine is None or replica is False or time.monotonic() < _replica["down_until"]:
+        return False
+    if replica is True:
+        return True
+
+    # Read-your-writes: a table this process wrote a moment ago may not be replayed yet
+    if tables:
+        recent = max(_recent_writes.get(t, 0.0) for t in (*tables, "*"))
+        if recent and time.monotonic() - recent < DB_READ_LAG_WINDOW:
+            _read_stats["lag_guarded"] += 1
+            return False
+    if DB_READ_MAX_LAG_MS:
+        lag = await _replica_lag_ms()
+        if lag is not None and lag > DB_READ_MAX_LAG_MS:
+            _read_stats["lag_guarded"] += 1
+            return False
+    return True
+
+def _replica_failed(error: Exception):
+    _replica["down_until"] = time.monotonic() + DB_READ_RETRY_AFTER
+    _read_stats["fallbacks"] += 1
+    logger.warning(f"Read replica unavailable, reading from primary for {DB_READ_RETRY_AFTER}s: {error}")
+
+@asynccontextmanager
+async def get_read_session(tables: tuple[str, ...] = (), replica: bool | None = None) -> AsyncSession:
+    """
+    Session for read-only work. It goes to the DB_READ_URL replica unless `replica=False`,
+    no replica is configured or it is failing, or (with replica=None) one of `tables` was
+    written by this process within DB_READ_LAG_WINDOW seconds or the measured replay lag
+    is above DB_READ_MAX_LAG_MS. Otherwise it is a regular get_session().
+    """
+    session = None
+    try:
+        if await _use_replica(tables, replica):
+            session = ReadSessionLocal()
+            await session.connection()
+    except Exception as e:
+        if session is not None:
+            await session.close()
+        session = None
+        _replica_failed(e)
+
+    if session is None:
+        _read_stats["primary"] += 1
+        async with get_session() as primary:
+            yield primary
+        return
+
+    _read_stats["replica"] += 1
+    try:
         yield session
+    finally:
+        await session.close()
+
+def read_routing_stats() -> dict:
+    return {
+        "replica_configured": read_engine is not None,
+        "replica_available": read_engine is not None and time.monotonic() >= _replica["down_until"],
+        "replica_lag_ms": _replica["lag_ms"],
+        **_read_stats,
+    }
+
 
+def create_indexes(sync_conn, metadata):
+    """create_all only builds indexes for tables it creates; add the missing ones on existing tables."""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
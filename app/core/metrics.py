@@ -0,0 +1,203 @@
+from bisect import bisect_left
+from functools import wraps
+import asyncio
+import inspect
+import threading
+import time
+import os
+
+# Prefix of every exported metric name
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "rag")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Minimal in-process metric in the Prometheus text exposition format. Values are per
+    process: with several uvicorn workers each one is its own scrape target.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = f"{METRICS_NAMESPACE}_{name}"
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> list[tuple[str, dict, float]]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self._samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self) -> list[tuple[str, dict, float]]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """
+    Metric read at scrape time from state the app already keeps (cache stats, pool
+    counters). `collect` returns [(labels, value)].
+    """
+
+    def __init__(self, name: str, documentation: str, type: str, collect):
+        super().__init__(name, documentation)
+        self.type = type
+        self.collect = collect
+
+    def _samples(self) -> list[tuple[str, dict, float]]:
+        return [(self.name, labels, value) for labels, value in self.collect()]
+
+
+def render_metrics() -> str:
+    parts = []
+    for metric in _registry:
+        try:
+            parts.append(metric.render())
+        except Exception as e:
+            # One failing collector must not break the whole scrape
+            parts.append(f"# {metric.name} unavailable: {e!r}")
+    return "\n".join(parts) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds",
+    "Duration of a pipeline stage (embedding, search, graph node, LLM, log write).",
+    ("stage", "outcome"),
+)
+
+
+def _is_error_result(result) -> bool:
+    # The services report handled failures as {"status": "error", ...} instead of raising
+    return isinstance(result, dict) and result.get("status") == "error"
+
+
+class timed:
+    """
+    Record the duration of a stage into STAGE_SECONDS, labelled ok or error.
+    Error means an exception escaped, the decorated function returned a
+    {"status": "error"} dict, or the block set `failed`. Works as a decorator
+    (sync or async functions) and as a context manager:
+
+        @timed("embedding.query")
+        async def _embed_query(text): ...
+
+        with timed("log_writer.flush") as timer:
+            ...
+            timer.failed = True
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.failed = False
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        # Cancellation (client gone, shutdown) is not a failure of the stage
+        if exc_type is None:
+            outcome = "error" if self.failed else "ok"
+        else:
+            outcome = "ok" if issubclass(exc_type, asyncio.CancelledError) else "error"
+        STAGE_SECONDS.observe(elapsed, stage=self.stage, outcome=outcome)
+        return False
+
+    def __call__(self, fn):
+        stage = self.stage
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timed(stage) as timer:
+                    result = await fn(*args, **kwargs)
+                    timer.failed = _is_error_result(result)
+                    return result
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage) as timer:
+                result = fn(*args, **kwargs)
+                timer.failed = _is_error_result(result)
+                return result
+        return wrapper
@@ -0,0 +1,57 @@
+from app.core.database import request_scope
+from app.core.metrics import Gauge, Histogram
+import time
+
+class RequestSessionMiddleware:
+    """
+    Pure ASGI middleware giving each HTTP request a RequestScope, so the get_session()
+    calls made while handling it (including a streamed body) share one session.
+    Pure ASGI rather than BaseHTTPMiddleware, which would run the endpoint in another
+    task and buffer streaming responses.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        async with request_scope():
+            await self.app(scope, receive, send)
+
+
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled, including streaming bodies.")
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "HTTP request duration until the response body is sent.",
+                         ("method", "route", "status"))
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware counting in-flight requests and timing each one until its
+    (possibly streamed) body is complete. Labelled with the route template, not the
+    raw path, so ids in URLs do not create one series each.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route, status=status["code"])
@@ -0,0 +1,19 @@
+from fastapi import HTTPException
+from datetime import datetime
+import base64
+import json
+
+
+def encode_cursor(timestamp: datetime, key: str) -> str:
+    """Opaque keyset cursor pointing just after the row (timestamp, key)."""
+    raw = json.dumps({"ts": timestamp.isoformat(), "key": key})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(data["ts"]), data["key"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -1,41 +1,57 @@
 from fastapi import FastAPI
-from app.api import action_logs, chat, knowledge, audit
-from app.core.database import engine
-from app.models.document import Base as DocBase
-from app.models.audit import Base as AuditBase
-from app.models.action_log import Base as ActionLogBase
-from sqlalchemy import text
+from app.api import action_logs, chat, knowledge, audit, jobs, admin, health, metrics
+from app.core.middleware import RequestSessionMiddleware, MetricsMiddleware
+from app.services.vector_index import index_maintainer
+from app.services.log_writer import log_writer
+from app.services.file_extractor import shutdown_pool
+from app.services.ingestion_jobs import ingestion_workers
+from app.services.checkpointer import start_checkpointer, stop_checkpointer
+from app.services.log_partitions import partition_maintainer
+from app.services.warmup import start_warm_up, stop_warm_up
 from dotenv import load_dotenv
-from loguru import logger
 import os
 
 load_dotenv()
 
+# Deployments with several workers/replicas run `python -m app.scripts.migrate` once per deploy and set this to false
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "true").lower() == "true"
+
 # Initialize FastAPI app
 app = FastAPI()
+app.add_middleware(RequestSessionMiddleware)
+# Added last so it is outermost and times the whole request
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(knowledge.router, prefix="/knowledge")
 app.include_router(chat.router, prefix="/chat")
 app.include_router(audit.router, prefix="/audit")
 app.include_router(action_logs.router, prefix="/logs", tags=["Action Logs"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Ingestion Jobs"])
+app.include_router(admin.router, prefix="/admin", tags=["Admin"])
+app.include_router(health.router, prefix="/health", tags=["Health"])
+app.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
 
 @app.on_event("startup")
 async def startup():
-    async with engine.begin() as conn:
-        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
-
-        await conn.run_sync(DocBase.metadata.create_all)
-        await conn.run_sync(AuditBase.metadata.create_all)
-        await conn.run_sync(ActionLogBase.metadata.create_all)
-        
-        lists = int(os.getenv("PGVECTOR_LISTS", 100))
-        await conn.execute(text(f"""
-            CREATE INDEX IF NOT EXISTS documents_embedding_idx
-            ON documents
-            USING ivfflat (embedding vector_cosine_ops)
-            WITH (lists = {lists});
-        """))
+    if RUN_MIGRATIONS_ON_STARTUP:
+        from app.scripts.migrate import run_migrations
+        await run_migrations()
 
-        await conn.execute(text("ANALYZE documents;"))
+    await start_checkpointer()
+    await log_writer.start()
+    await partition_maintainer.start()
+    await ingestion_workers.start()
+    # Builds the ANN index (or defers it while the table is small) and runs ANALYZE in the background
+    await index_maintainer.start()
+    # Clients and graph are built in the background; /health/ready reports when it is done
+    start_warm_up()
 
-        logger.info("Pgvector installed, tables created, and IVFFlat index optimized.")
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_warm_up()
+    await index_maintainer.stop()
+    await ingestion_workers.stop()
+    await partition_maintainer.stop()
+    await log_writer.stop()
+    await stop_checkpointer()
+    shutdown_pool()
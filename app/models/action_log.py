@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, Integer
+from sqlalchemy import Column, String, Text, DateTime, Integer, Index
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
@@ -19,4 +19,15 @@ class ActionLog(Base):
     error_message = Column(Text, nullable=True)
     latency_ms = Column(Integer, nullable=True)
     extra_info = Column(JSONB, nullable=True)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Partition key, so it has to be part of the primary key
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now())
+
+    # Newest-first listing and keyset pagination, alone or with one equality filter
+    __table_args__ = (
+        Index("ix_action_logs_timestamp_id", "timestamp", "id"),
+        Index("ix_action_logs_action_type_timestamp_id", "action_type", "timestamp", "id"),
+        Index("ix_action_logs_resource_type_timestamp_id", "resource_type", "timestamp", "id"),
+        Index("ix_action_logs_status_timestamp_id", "status", "timestamp", "id"),
+        # Partitions are created and dropped by app.services.log_partitions
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, Integer, TIMESTAMP, ARRAY
+from sqlalchemy import Column, String, Text, Integer, TIMESTAMP, ARRAY, Index
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -12,5 +12,12 @@ class AuditLog(Base):
     response = Column(Text, nullable=False)
     retrieved_docs = Column(ARRAY(String), nullable=False)
     latency_ms = Column(Integer)
-    timestamp = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    # Partition key, so it has to be part of the primary key
+    timestamp = Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False, server_default=func.now())
     feedback = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_audit_logs_timestamp_chat_id", "timestamp", "chat_id"),
+        # Partitions are created and dropped by app.services.log_partitions
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
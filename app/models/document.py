@@ -1,8 +1,15 @@
-from sqlalchemy import Column, String, Text, DateTime
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, String, Text, DateTime, Computed, Index, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.sql import func
 from pgvector.sqlalchemy import Vector
 from sqlalchemy.ext.declarative import declarative_base
+import os
+
+# Dimension of documents.embedding; changing it on a populated table goes through app/scripts/reindex_embeddings.py
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 768))
+
+# Text search configuration of content_tsv; queries must use the same one to hit the GIN index
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "simple")
 
 Base = declarative_base()
 
@@ -11,6 +18,18 @@ class Document(Base):
 
     id = Column(String, primary_key=True, index=True)
     content = Column(Text, nullable=False)
-    embedding = Column(Vector(768))
+    content_hash = Column(String(64), index=True)  # sha256 of content, to skip re-embedding identical text
+    embedding = Column(Vector(EMBEDDING_DIM))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     extra_info = Column(JSONB, nullable=True)
+    source = Column(String, nullable=True, index=True)  # file/source a chunk belongs to, see vector_store.sync_source
+    content_tsv = Column(TSVECTOR, Computed(f"to_tsvector('{TEXT_SEARCH_CONFIG}', content)", persisted=True))
+
+    __table_args__ = (
+        Index("documents_content_tsv_idx", "content_tsv", postgresql_using="gin"),
+        # Serves metadata filters (extra_info @> ...); jsonb_path_ops is smaller and faster for containment
+        Index("documents_extra_info_idx", "extra_info", postgresql_using="gin", postgresql_ops={"extra_info": "jsonb_path_ops"}),
+        Index("documents_filename_idx", text("(extra_info ->> 'filename')")),
+        # Keyset pagination of /knowledge
+        Index("ix_documents_created_at_id", "created_at", "id"),
+    )
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, DateTime, Index
+from sqlalchemy.sql import func
+from pgvector.sqlalchemy import Vector
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+
+class EmbeddingCache(Base):
+    __tablename__ = "embedding_cache"
+
+    key = Column(String, primary_key=True)  # sha256 of model name + dimension + normalized text
+    model = Column(String, nullable=False)
+    embedding = Column(Vector(), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Retention deletes by age (prune_embedding_cache)
+        Index("ix_embedding_cache_created_at", "created_at"),
+    )
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, String, Text, DateTime, Integer, Boolean, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from sqlalchemy.ext.declarative import declarative_base
+import uuid
+
+Base = declarative_base()
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    kind = Column(String, nullable=False)  # upload | update
+    status = Column(String, nullable=False, default="queued")  # queued | running | completed | failed | cancelled
+    filename = Column(String, nullable=True)
+    source = Column(String, nullable=True)  # chunk set an upload job syncs, the file name when not set
+    file_path = Column(String, nullable=True)
+    payload = Column(JSONB, nullable=True)  # documents of an update job
+    total_chunks = Column(Integer, nullable=True)
+    processed_chunks = Column(Integer, nullable=False, default=0)  # resume position in the chunk stream
+    succeeded_chunks = Column(Integer, nullable=False, default=0)
+    failed_chunks = Column(Integer, nullable=False, default=0)
+    failures = Column(JSONB, nullable=False, default=list)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    worker_id = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_ingestion_jobs_status_created_at", "status", "created_at"),
+    )
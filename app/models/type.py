@@ -7,6 +7,11 @@ class ChatState(dict):
     latency_ms: int
     chat_id: str
     enable_reasoning: bool
+    query_embedding: list
+    cached: bool
+    retrieval: dict
+    expanded_queries: list
+    expanded_docs: list
     
 class LogsStatus(str, Enum):
     SUCCESS = 'success'
@@ -20,4 +25,5 @@ class LogsActionType(str, Enum):
     DELETE = 'delete'
     CHAT = 'chat'
     UPDATE = 'updated'
-    INSERT = 'inserted'
\ No newline at end of file
+    INSERT = 'inserted'
+    UNCHANGED = 'unchanged'
\ No newline at end of file
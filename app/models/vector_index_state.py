@@ -0,0 +1,20 @@
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Float
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+
+class VectorIndexState(Base):
+    """What the ANN index was built from, so app.services.vector_index can tell when it has gone stale."""
+    __tablename__ = "vector_index_state"
+
+    index_name = Column(String, primary_key=True)
+    index_type = Column(String, nullable=False)  # ivfflat | hnsw
+    storage_mode = Column(String, nullable=False)  # full | halfvec | binary
+    lists = Column(Integer, nullable=True)  # ivfflat only
+    rows_at_build = Column(BigInteger, nullable=False)
+    changes_at_build = Column(BigInteger, nullable=False)  # n_tup_upd + n_tup_del of documents at build time, to measure drift
+    built_at = Column(DateTime(timezone=True), nullable=False)
+    build_seconds = Column(Float, nullable=True)
+    recall = Column(Float, nullable=True)  # estimated recall@k of the ANN search against an exact scan
+    recall_checked_at = Column(DateTime(timezone=True), nullable=True)
+    analyzed_at = Column(DateTime(timezone=True), nullable=True)
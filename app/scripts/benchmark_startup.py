@@ -0,0 +1,70 @@
+"""
+Measure cold-start cost of the API.
+
+    python -m app.scripts.benchmark_startup [--runs 5] [--serve] [--port 8765]
+
+- import: time to `import app.main` in a fresh interpreter (median of --runs)
+- with --serve: starts uvicorn and measures the time until /health/live answers
+  (process accepting requests) and until /health/ready answers 200 (warm-up done).
+  Needs the database from DB_URL; set RUN_MIGRATIONS_ON_STARTUP as in the deployment.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+def measure_import(runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-W", "ignore", "-c", IMPORT_SNIPPET],
+                                capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+def _status(url: str) -> int | None:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+def measure_serve(port: int, timeout: float) -> dict:
+    base = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    timings = {"live_s": None, "ready_s": None}
+    try:
+        while time.perf_counter() - start < timeout and server.poll() is None:
+            if timings["live_s"] is None and _status(f"{base}/live") == 200:
+                timings["live_s"] = round(time.perf_counter() - start, 3)
+            if timings["live_s"] is not None and _status(f"{base}/ready") == 200:
+                timings["ready_s"] = round(time.perf_counter() - start, 3)
+                break
+            time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import and startup time of the API")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters used to time the import")
+    parser.add_argument("--serve", action="store_true", help="also time uvicorn until /health/live and /health/ready")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for readiness")
+    args = parser.parse_args()
+
+    timings = measure_import(args.runs)
+    print(f"import app.main: median {statistics.median(timings):.3f}s, "
+          f"min {min(timings):.3f}s, max {max(timings):.3f}s over {args.runs} runs")
+    if args.serve:
+        served = measure_serve(args.port, args.timeout)
+        print(f"uvicorn: live after {served['live_s']}s, ready after {served['ready_s']}s")
@@ -0,0 +1,56 @@
+"""
+Create or upgrade the database schema. Run once per deploy, before the app starts:
+
+    python -m app.scripts.migrate
+
+With RUN_MIGRATIONS_ON_STARTUP=true the app runs it itself at startup instead (single
+instance / local setups). An advisory lock serializes concurrent runs, so replicas booting
+together wait for one migration instead of contending on DDL locks.
+"""
+from sqlalchemy import text
+from loguru import logger
+from app.core.database import maintenance_engine, create_indexes
+from app.services.vector_store import ensure_document_columns
+from app.services.log_partitions import prepare_log_tables, copy_legacy_rows, maintain_log_partitions
+from app.models.document import Base as DocBase
+from app.models.audit import Base as AuditBase
+from app.models.action_log import Base as ActionLogBase
+from app.models.embedding_cache import Base as EmbeddingCacheBase
+from app.models.ingestion_job import Base as IngestionJobBase
+from app.models.vector_index_state import Base as VectorIndexStateBase
+import asyncio
+import time
+
+_ADVISORY_LOCK_ID = 7_242_003
+
+async def run_migrations():
+    start = time.time()
+    async with maintenance_engine.begin() as conn:
+        await conn.execute(text(f"SELECT pg_advisory_xact_lock({_ADVISORY_LOCK_ID})"))
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
+
+        legacy_log_tables = await prepare_log_tables(conn)
+        await conn.run_sync(DocBase.metadata.create_all)
+        await ensure_document_columns(conn)
+        await conn.run_sync(create_indexes, DocBase.metadata)
+        await conn.run_sync(AuditBase.metadata.create_all)
+        await conn.run_sync(ActionLogBase.metadata.create_all)
+        await conn.run_sync(create_indexes, AuditBase.metadata)
+        await conn.run_sync(create_indexes, ActionLogBase.metadata)
+        await maintain_log_partitions(conn)
+        await copy_legacy_rows(conn, legacy_log_tables)
+        await conn.run_sync(EmbeddingCacheBase.metadata.create_all)
+        await conn.run_sync(create_indexes, EmbeddingCacheBase.metadata)
+        await conn.run_sync(IngestionJobBase.metadata.create_all)
+        await conn.execute(text("ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS source VARCHAR"))
+        await conn.run_sync(VectorIndexStateBase.metadata.create_all)
+
+    # The ANN index is not built here: app.services.vector_index builds it once there is data
+    logger.info(f"Pgvector installed and tables created in {time.time() - start:.1f}s")
+
+async def main():
+    await run_migrations()
+    await maintenance_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
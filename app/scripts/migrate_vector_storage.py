@@ -0,0 +1,71 @@
+"""
+Switch the ANN index to the configured VECTOR_STORAGE_MODE / VECTOR_INDEX_TYPE without downtime.
+
+    1. VECTOR_STORAGE_MODE=halfvec python -m app.scripts.migrate_vector_storage
+    2. deploy the app with VECTOR_STORAGE_MODE=halfvec
+    3. VECTOR_STORAGE_MODE=halfvec python -m app.scripts.migrate_vector_storage --drop-old
+
+Step 1 builds the new index with CREATE INDEX CONCURRENTLY (reads and writes continue) next to
+the current one, which the running app keeps searching with until the deploy. The index
+expression is computed from the stored full vectors, so existing rows need no rewrite.
+Step 3 drops the ANN indexes of the other modes concurrently. Dropping before the deploy would
+leave the running app without an index, and its maintainer would rebuild the old one.
+"""
+from sqlalchemy import text
+from app.core.database import maintenance_engine
+from app.services.embedding import refresh_embedding_layout
+from app.services.vector_store import vector_index_name, vector_index_sql, VECTOR_INDEX_NAME, VECTOR_STORAGE_MODE
+from app.services.vector_index import choose_lists, table_stats, record_build, index_info
+import argparse
+import asyncio
+import time
+
+async def build(conn):
+    # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+    info = await index_info(conn)
+    if info is not None and not info["valid"]:
+        print(f"Dropping invalid index {VECTOR_INDEX_NAME} left by an earlier build")
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}"))
+
+    lists = choose_lists((await table_stats(conn))["rows"])
+    start = time.time()
+    print(f"Building {VECTOR_INDEX_NAME} ({VECTOR_STORAGE_MODE})...")
+    await conn.execute(text(vector_index_sql(concurrently=True, lists=lists)))
+    print(f"Built in {time.time() - start:.1f}s")
+    await record_build(conn, lists, time.time() - start)
+    await conn.execute(text("ANALYZE documents"))
+
+    result = await conn.execute(text("SELECT pg_size_pretty(pg_relation_size(:name))"), {"name": VECTOR_INDEX_NAME})
+    print(f"{VECTOR_INDEX_NAME} size: {result.scalar()}")
+    print(f"Deploy the app with VECTOR_STORAGE_MODE={VECTOR_STORAGE_MODE}, then run again with --drop-old.")
+
+async def drop_old(conn):
+    info = await index_info(conn)
+    if info is None or not info["valid"]:
+        raise SystemExit(f"{VECTOR_INDEX_NAME} is missing or invalid: build it before dropping the other indexes")
+
+    others = {
+        vector_index_name(index_type, mode)
+        for index_type in ("ivfflat", "hnsw")
+        for mode in ("full", "halfvec", "binary")
+    } - {VECTOR_INDEX_NAME}
+    for name in sorted(others):
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    print(f"Dropped other ANN indexes (if present): {', '.join(sorted(others))}")
+
+async def migrate(drop: bool):
+    # The index expression uses the dimension documents.embedding has, which a reindex may have changed
+    await refresh_embedding_layout(force=True)
+    async with maintenance_engine.connect() as conn:
+        # CONCURRENTLY cannot run inside a transaction block
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if drop:
+            await drop_old(conn)
+        else:
+            await build(conn)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the ANN index for VECTOR_STORAGE_MODE, or drop the others once deployed")
+    parser.add_argument("--drop-old", action="store_true",
+                        help="drop the ANN indexes of the other modes; run after the app uses the new mode everywhere")
+    asyncio.run(migrate(parser.parse_args().drop_old))
@@ -0,0 +1,205 @@
+"""
+Re-embed the whole corpus at a new EMBEDDING_DIM (or with a new EMBEDDING_MODEL_NAME) while the app keeps serving.
+
+    EMBEDDING_DIM=256 EMBEDDING_REQUEST_DIM=true python -m app.scripts.reindex_embeddings [--batch-size N] [--keep-old] [--restart]
+
+1. Adds a shadow column documents.embedding_next vector(EMBEDDING_DIM), commented with the model
+   name, and a trigger that clears it whenever a row's content changes, so edits made during the
+   reindex are picked up again.
+2. Fills embedding_next in batches of rows where it is NULL. Interrupted runs resume where they stopped.
+3. Builds the ANN index on embedding_next with CREATE INDEX CONCURRENTLY.
+4. Swaps in one short transaction: drops the old ANN index, renames embedding -> embedding_old and
+   embedding_next -> embedding, and renames the new index. Nothing is embedded while the table is
+   locked: rows left without a shadow vector are filled first, and the swap is retried if more
+   appeared meanwhile.
+5. Drops embedding_old unless --keep-old.
+
+The running app reads the column dimensions from the database (see embedding.embedding_dims):
+while embedding_next exists it writes new documents to both columns, and after the swap it
+queries at the new dimension, so a dimension change needs no redeploy. Set EMBEDDING_DIM in the
+app config afterwards for new databases. A model change still needs the app deployed with the new
+EMBEDDING_MODEL_NAME right after the swap: an app on the old model does not write embedding_next,
+and its queries do not match the new vectors.
+"""
+from sqlalchemy import text
+from app.core.database import maintenance_engine
+from app.models.document import EMBEDDING_DIM
+from app.services.embedding import (
+    get_embeddings, EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_CONCURRENCY, EMBEDDING_MODEL_NAME, SHADOW_EMBEDDING_COLUMN,
+)
+from app.services.vector_store import vector_index_sql, vector_index_name, VECTOR_INDEX_NAME
+from app.services.vector_index import choose_lists, table_stats, record_build
+import argparse
+import asyncio
+import json
+import time
+
+SHADOW_COLUMN = SHADOW_EMBEDDING_COLUMN
+SHADOW_INDEX = f"{VECTOR_INDEX_NAME}_next"
+# Partial index on the rows still to fill, so each batch and the check under the lock are index scans
+UNFILLED_INDEX = f"documents_{SHADOW_COLUMN}_null_idx"
+# Swap attempts before giving up when writes keep adding rows without a shadow vector
+SWAP_ATTEMPTS = 5
+
+async def _column_dim(conn, column: str) -> int | None:
+    """Declared dimension of a vector column (its typmod), None if the column does not exist."""
+    result = await conn.execute(text("""
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = 'documents'::regclass AND attname = :column AND NOT attisdropped
+    """), {"column": column})
+    return result.scalar_one_or_none()
+
+async def prepare(restart: bool):
+    async with maintenance_engine.begin() as conn:
+        current_dim = await _column_dim(conn, "embedding")
+        shadow_dim = await _column_dim(conn, SHADOW_COLUMN)
+        if restart or (shadow_dim is not None and shadow_dim != EMBEDDING_DIM):
+            print(f"Dropping previous {SHADOW_COLUMN} ({shadow_dim} dimensions)")
+            await conn.execute(text(f"ALTER TABLE documents DROP COLUMN IF EXISTS {SHADOW_COLUMN}"))
+
+        print(f"Re-embedding documents: {current_dim} -> {EMBEDDING_DIM} dimensions")
+        await conn.execute(text(f"ALTER TABLE documents ADD COLUMN IF NOT EXISTS {SHADOW_COLUMN} vector({EMBEDDING_DIM})"))
+        # Running apps only dual-write into the shadow column when they embed with this model
+        model = "NULL" if EMBEDDING_MODEL_NAME is None else "'" + EMBEDDING_MODEL_NAME.replace("'", "''") + "'"
+        await conn.execute(text(f"COMMENT ON COLUMN documents.{SHADOW_COLUMN} IS {model}"))
+        await conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION documents_reset_{SHADOW_COLUMN}() RETURNS trigger AS $$
+            BEGIN
+                NEW.{SHADOW_COLUMN} := NULL;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """))
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS documents_reset_{SHADOW_COLUMN} ON documents"))
+        await conn.execute(text(f"""
+            CREATE TRIGGER documents_reset_{SHADOW_COLUMN} BEFORE UPDATE OF content ON documents
+            FOR EACH ROW WHEN (OLD.content IS DISTINCT FROM NEW.content)
+            EXECUTE FUNCTION documents_reset_{SHADOW_COLUMN}()
+        """))
+
+    async with maintenance_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {UNFILLED_INDEX}"))
+        await conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY {UNFILLED_INDEX} ON documents (id) WHERE {SHADOW_COLUMN} IS NULL"
+        ))
+
+async def _fill_batch(conn, batch_size: int) -> int:
+    """Embed one batch of rows without a shadow vector. Returns the number of rows written."""
+    result = await conn.execute(text(f"""
+        SELECT id, content, content_hash FROM documents
+        WHERE {SHADOW_COLUMN} IS NULL ORDER BY id LIMIT :limit
+    """), {"limit": batch_size})
+    rows = result.all()
+    if not rows:
+        return 0
+
+    vectors = await get_embeddings([row.content for row in rows], dim=EMBEDDING_DIM)
+    # content_hash guard: a row edited while it was being embedded keeps NULL and is picked up again
+    await conn.execute(text(f"""
+        UPDATE documents SET {SHADOW_COLUMN} = CAST(:embedding AS vector)
+        WHERE id = :id AND content_hash IS NOT DISTINCT FROM :content_hash
+    """), [
+        {"id": row.id, "content_hash": row.content_hash, "embedding": json.dumps(vec)}
+        for row, vec in zip(rows, vectors)
+    ])
+    return len(rows)
+
+async def _remaining(conn) -> int:
+    result = await conn.execute(text(f"SELECT count(*) FROM documents WHERE {SHADOW_COLUMN} IS NULL"))
+    return result.scalar()
+
+async def _unfilled(conn) -> bool:
+    result = await conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM documents WHERE {SHADOW_COLUMN} IS NULL)"))
+    return result.scalar()
+
+async def backfill(batch_size: int):
+    start = time.time()
+    done = 0
+    async with maintenance_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        total = await _remaining(conn)
+        while True:
+            written = await _fill_batch(conn, batch_size)
+            if not written:
+                break
+            done += written
+            rate = done / (time.time() - start)
+            print(f"  {done}/{total} rows re-embedded ({rate:.0f} rows/s)")
+    print(f"Backfill finished in {time.time() - start:.1f}s")
+
+async def build_index():
+    async with maintenance_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {SHADOW_INDEX}"))
+        lists = choose_lists((await table_stats(conn))["rows"])
+        start = time.time()
+        print(f"Building {SHADOW_INDEX}...")
+        await conn.execute(text(vector_index_sql(
+            concurrently=True, column=SHADOW_COLUMN, dim=EMBEDDING_DIM, name=SHADOW_INDEX, lists=lists
+        )))
+        print(f"Built in {time.time() - start:.1f}s")
+        return lists
+
+async def _try_swap() -> bool:
+    """
+    Swap the columns under an ACCESS EXCLUSIVE lock, held only for catalog changes.
+    Returns False without changing anything if rows without a shadow vector appeared since the backfill.
+    """
+    old_indexes = {vector_index_name(t, m) for t in ("ivfflat", "hnsw") for m in ("full", "halfvec", "binary")}
+    async with maintenance_engine.connect() as conn:
+        trans = await conn.begin()
+        await conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+        await conn.execute(text("LOCK TABLE documents IN ACCESS EXCLUSIVE MODE"))
+        if await _unfilled(conn):
+            await trans.rollback()
+            return False
+        for name in sorted(old_indexes):
+            await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        await conn.execute(text(f"DROP INDEX IF EXISTS {UNFILLED_INDEX}"))
+        await conn.execute(text("ALTER TABLE documents DROP COLUMN IF EXISTS embedding_old"))
+        await conn.execute(text("ALTER TABLE documents RENAME COLUMN embedding TO embedding_old"))
+        await conn.execute(text(f"ALTER TABLE documents RENAME COLUMN {SHADOW_COLUMN} TO embedding"))
+        await conn.execute(text(f"ALTER INDEX {SHADOW_INDEX} RENAME TO {VECTOR_INDEX_NAME}"))
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS documents_reset_{SHADOW_COLUMN} ON documents"))
+        await conn.execute(text(f"DROP FUNCTION IF EXISTS documents_reset_{SHADOW_COLUMN}()"))
+        await trans.commit()
+    return True
+
+async def swap(batch_size: int, keep_old: bool, lists: int):
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        # Catch up outside the lock: rows written by apps on another model, or edited meanwhile
+        await backfill(batch_size)
+        if await _try_swap():
+            break
+        print(f"Rows without {SHADOW_COLUMN} appeared before the swap (attempt {attempt}/{SWAP_ATTEMPTS}), catching up")
+    else:
+        raise SystemExit(f"Writes kept adding rows without {SHADOW_COLUMN}; run again when the write load is lower")
+    print(f"Swapped: documents.embedding is now vector({EMBEDDING_DIM}), indexed by {VECTOR_INDEX_NAME}")
+
+    async with maintenance_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not keep_old:
+            await conn.execute(text("ALTER TABLE documents DROP COLUMN IF EXISTS embedding_old"))
+            print("Dropped embedding_old")
+        await conn.execute(text("ANALYZE documents"))
+        # Every row was rewritten: start the index manager's drift count from here
+        await record_build(conn, lists)
+
+async def reindex(batch_size: int, keep_old: bool, restart: bool):
+    await prepare(restart)
+    await backfill(batch_size)
+    lists = await build_index()
+    await swap(batch_size, keep_old, lists)
+    print(f"Set EMBEDDING_DIM={EMBEDDING_DIM} (and the model, if it changed) in the app config and deploy it.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed all documents into a shadow column and swap it in")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE * EMBEDDING_MAX_CONCURRENCY,
+                        help="rows embedded and written per round trip")
+    parser.add_argument("--keep-old", action="store_true", help="keep the previous vectors as embedding_old (e.g. to roll back)")
+    parser.add_argument("--restart", action="store_true", help="discard a partially filled shadow column and start over")
+    args = parser.parse_args()
+    asyncio.run(reindex(args.batch_size, args.keep_old, args.restart))
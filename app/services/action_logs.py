@@ -1,10 +1,50 @@
 from app.models.action_log import ActionLog
-from app.core.database import get_session
-from sqlalchemy.dialects.postgresql import insert
+from app.core.database import get_session, get_read_session
+from app.services.log_writer import log_writer
+from app.core.pagination import encode_cursor, decode_cursor
 from loguru import logger
+from datetime import datetime, timezone
 import traceback
+import base64
+import json
+import uuid
+import zlib
+import os
 from fastapi import Query, HTTPException
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
+
+LOG_PAYLOAD_MAX_BYTES = int(os.getenv("LOG_PAYLOAD_MAX_BYTES", 0))
+LOG_PAYLOAD_MODE = os.getenv("LOG_PAYLOAD_MODE", "truncate").lower()
+
+def compact_payload(payload):
+    """
+    Shrink request/response payloads above LOG_PAYLOAD_MAX_BYTES (0 = keep as is).
+    `compress` stores zlib+base64, falling back to truncation if that is still too big;
+    `truncate` keeps a prefix of the JSON text.
+    """
+    if payload is None or LOG_PAYLOAD_MAX_BYTES <= 0:
+        return payload
+
+    raw = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+    if len(raw) <= LOG_PAYLOAD_MAX_BYTES:
+        return payload
+
+    if LOG_PAYLOAD_MODE == "compress":
+        packed = base64.b64encode(zlib.compress(raw)).decode("ascii")
+        if len(packed) <= LOG_PAYLOAD_MAX_BYTES:
+            return {"_compressed": "zlib+base64", "original_bytes": len(raw), "data": packed}
+
+    return {
+        "_truncated": True,
+        "original_bytes": len(raw),
+        "preview": raw[:LOG_PAYLOAD_MAX_BYTES].decode("utf-8", errors="ignore"),
+    }
+
+def expand_payload(payload):
+    """Inverse of compact_payload for compressed payloads; truncated ones are returned as stored."""
+    if isinstance(payload, dict) and payload.get("_compressed") == "zlib+base64":
+        return json.loads(zlib.decompress(base64.b64decode(payload["data"])))
+    return payload
 
 async def log_action(
     action_type: str,
@@ -17,33 +57,44 @@ async def log_action(
     latency_ms: int = None,
     extra_info: dict = None
 ):
-    async with get_session() as session:
-        try:
-            stmt = insert(ActionLog).values(
-                action_type=action_type,
-                resource_type=resource_type,
-                resource_id=resource_id,
-                request_data=request_data,
-                response_data=response_data,
-                status=status,
-                error_message=error_message,
-                latency_ms=latency_ms,
-                extra_info=extra_info
-            )
-            await session.execute(stmt)
-            await session.commit()
-        except Exception as e:
-            logger.error(f"Failed to log action: {e}\n{traceback.format_exc()}")
+    """Queue one action log row, written in the background by log_writer."""
+    try:
+        await log_writer.enqueue(ActionLog, {
+            "id": str(uuid.uuid4()),
+            "action_type": action_type,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "request_data": compact_payload(request_data),
+            "response_data": compact_payload(response_data),
+            "status": status,
+            "error_message": error_message,
+            "latency_ms": latency_ms,
+            "extra_info": extra_info,
+            "timestamp": datetime.now(timezone.utc),
+        })
+    except Exception as e:
+        logger.error(f"Failed to log action: {e}\n{traceback.format_exc()}")
 
 async def list_all_action_logs(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=500),
     action_type: str | None = None,
     resource_type: str | None = None,
-    status: str | None = None
+    status: str | None = None,
+    start_time: datetime | None = None,
+    end_time: datetime | None = None,
+    cursor: str | None = None,
+    keyset: bool = False,
+    replica: bool | None = None
 ):
-    async with get_session() as session:
-        stmt = select(ActionLog).order_by(ActionLog.timestamp.desc())
+    """
+    Newest first. Offset mode (default) returns a list, as before.
+    Keyset mode (`keyset` or a `cursor`) returns {"items": [...], "next_cursor": ...};
+    pass next_cursor back to get the following page without scanning skipped rows.
+    Served by the read replica when one is configured (a slightly stale page is fine for logs).
+    """
+    async with get_read_session(replica=replica) as session:
+        stmt = select(ActionLog).order_by(ActionLog.timestamp.desc(), ActionLog.id.desc())
 
         if action_type:
             stmt = stmt.where(ActionLog.action_type == action_type)
@@ -51,12 +102,23 @@ async def list_all_action_logs(
             stmt = stmt.where(ActionLog.resource_type == resource_type)
         if status:
             stmt = stmt.where(ActionLog.status == status)
+        if start_time:
+            stmt = stmt.where(ActionLog.timestamp >= start_time)
+        if end_time:
+            stmt = stmt.where(ActionLog.timestamp < end_time)
+
+        if cursor:
+            last_ts, last_id = decode_cursor(cursor)
+            stmt = stmt.where(tuple_(ActionLog.timestamp, ActionLog.id) < tuple_(last_ts, last_id))
+        elif not keyset:
+            stmt = stmt.offset(skip)
 
-        stmt = stmt.offset(skip).limit(limit)
-        result = await session.execute(stmt)
+        # One extra row tells whether another page exists
+        result = await session.execute(stmt.limit(limit + 1))
         logs = result.scalars().all()
+        page = logs[:limit]
 
-        return [
+        items = [
             {
                 "id": log.id,
                 "action_type": log.action_type,
@@ -66,8 +128,14 @@ async def list_all_action_logs(
                 "latency_ms": log.latency_ms,
                 "timestamp": log.timestamp,
             }
-            for log in logs
+            for log in page
         ]
+
+        if not (cursor or keyset):
+            return items
+
+        next_cursor = encode_cursor(page[-1].timestamp, page[-1].id) if len(logs) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
         
 async def search_log_by_id(log_id: str):
     async with get_session() as session:
@@ -81,8 +149,8 @@ async def search_log_by_id(log_id: str):
             "action_type": log.action_type,
             "resource_type": log.resource_type,
             "resource_id": log.resource_id,
-            "request_data": log.request_data,
-            "response_data": log.response_data,
+            "request_data": expand_payload(log.request_data),
+            "response_data": expand_payload(log.response_data),
             "status": log.status,
             "error_message": log.error_message,
             "latency_ms": log.latency_ms,
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from loguru import logger
+import numpy as np
+import hashlib
+import time
+import uuid
+import os
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 3600))
+
+def docs_fingerprint(docs: list[dict]) -> tuple:
+    """
+    Identity of a retrieval result: doc ids in rank order plus a hash of each content.
+    A changed document changes its hash, so a stale answer never matches even in other workers.
+    """
+    return tuple(
+        (doc["id"], hashlib.sha256(doc["content"].encode("utf-8")).hexdigest()[:16])
+        for doc in docs
+    )
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by query embedding. A lookup hits when a stored query is within
+    `threshold` cosine similarity AND was answered from the same retrieved documents.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None, threshold: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._by_fingerprint: dict[tuple, set] = {}
+        self._by_doc: dict[str, set] = {}
+
+    def lookup(self, query_emb: list[float], mode: str, fingerprint: tuple) -> dict | None:
+        query = _unit(query_emb)
+        best, best_score = None, self.threshold
+        now = time.monotonic()
+
+        for entry_id in list(self._by_fingerprint.get((mode, fingerprint), ())):
+            entry = self._entries[entry_id]
+            if entry["expires_at"] is not None and entry["expires_at"] <= now:
+                self._remove(entry_id)
+                continue
+            # Stored before a reindex changed the embedding dimension: not comparable
+            if len(entry["embedding"]) != len(query):
+                continue
+            score = float(np.dot(query, entry["embedding"]))
+            if score >= best_score:
+                best, best_score = entry, score
+
+        if best is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(best["id"])
+        self.hits += 1
+        return {"answer": best["answer"], "reasoning": best["reasoning"], "similarity": best_score}
+
+    def store(self, query_emb: list[float], mode: str, fingerprint: tuple, answer: str, reasoning: str = ""):
+        if self.maxsize <= 0 or not answer:
+            return
+        entry_id = str(uuid.uuid4())
+        self._entries[entry_id] = {
+            "id": entry_id,
+            "embedding": _unit(query_emb),
+            "key": (mode, fingerprint),
+            "answer": answer,
+            "reasoning": reasoning,
+            "expires_at": time.monotonic() + self.ttl if self.ttl else None,
+        }
+        self._by_fingerprint.setdefault((mode, fingerprint), set()).add(entry_id)
+        for doc_id, _ in fingerprint:
+            self._by_doc.setdefault(doc_id, set()).add(entry_id)
+
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_docs(self, doc_ids) -> int:
+        """Drop every entry answered from any of `doc_ids`. Called after documents are written or deleted."""
+        removed = 0
+        for doc_id in doc_ids:
+            for entry_id in list(self._by_doc.get(doc_id, ())):
+                self._remove(entry_id)
+                removed += 1
+        if removed:
+            self.invalidations += removed
+            logger.info(f"Answer cache: invalidated {removed} entries")
+        return removed
+
+    def clear(self):
+        self._entries.clear()
+        self._by_fingerprint.clear()
+        self._by_doc.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _remove(self, entry_id: str):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        _discard(self._by_fingerprint, entry["key"], entry_id)
+        for doc_id, _ in entry["key"][1]:
+            _discard(self._by_doc, doc_id, entry_id)
+
+def _unit(vec: list[float]) -> np.ndarray:
+    arr = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(arr)
+    return arr / norm if norm else arr
+
+def _discard(index: dict, key, entry_id: str):
+    ids = index.get(key)
+    if ids is None:
+        return
+    ids.discard(entry_id)
+    if not ids:
+        del index[key]
+
+answer_cache = SemanticAnswerCache(
+    maxsize=ANSWER_CACHE_SIZE if ANSWER_CACHE_ENABLED else 0,
+    ttl=ANSWER_CACHE_TTL or None,
+    threshold=ANSWER_CACHE_THRESHOLD,
+)
@@ -1,23 +1,22 @@
-from sqlalchemy import insert
 from fastapi import Query, HTTPException
 from app.models.audit import AuditLog
-from app.core.database import get_session
-from datetime import datetime
-from sqlalchemy import select
+from app.core.database import get_session, get_read_session
+from app.services.log_writer import log_writer
+from app.core.pagination import encode_cursor, decode_cursor
+from datetime import datetime, timezone
+from sqlalchemy import select, tuple_
 
 async def log_audit(chat_id: str, question: str, response: str, retrieved_docs: list[str], latency_ms: int):
-    async with get_session() as session:
-        stmt = insert(AuditLog).values(
-            chat_id=chat_id,
-            question=question,
-            response=response,
-            retrieved_docs=retrieved_docs,
-            latency_ms=latency_ms,
-            timestamp=datetime.now(),
-        )
-        await session.execute(stmt)
-        await session.commit()
-        
+    """Queue one audit row, written in the background by log_writer."""
+    await log_writer.enqueue(AuditLog, {
+        "chat_id": chat_id,
+        "question": question,
+        "response": response,
+        "retrieved_docs": retrieved_docs,
+        "latency_ms": latency_ms,
+        "timestamp": datetime.now(timezone.utc),
+    })
+
 async def search_audit_by_id(chat_id: str):
     async with get_session() as session:
         result = await session.execute(select(AuditLog).where(AuditLog.chat_id == chat_id))
@@ -36,15 +35,37 @@ async def search_audit_by_id(chat_id: str):
             "feedback": log.feedback
         }
 
-async def list_audit_logs(limit: int = Query(50, ge=10, le=100), skip: int = Query(0, ge=0)):
-    async with get_session() as session:
-        stmt = select(AuditLog).order_by(AuditLog.timestamp.desc()).limit(limit=limit)
-        
-        stmt = stmt.offset(skip).limit(limit)
-        result = await session.execute(stmt)
+async def list_audit_logs(limit: int = Query(50, ge=10, le=100),
+                          skip: int = Query(0, ge=0),
+                          start_time: datetime | None = None,
+                          end_time: datetime | None = None,
+                          cursor: str | None = None,
+                          keyset: bool = False,
+                          replica: bool | None = None):
+    """
+    Newest first. Offset mode (default) returns a list, as before.
+    Keyset mode (`keyset` or a `cursor`) returns {"items": [...], "next_cursor": ...}.
+    Served by the read replica when one is configured.
+    """
+    async with get_read_session(replica=replica) as session:
+        stmt = select(AuditLog).order_by(AuditLog.timestamp.desc(), AuditLog.chat_id.desc())
+
+        if start_time:
+            stmt = stmt.where(AuditLog.timestamp >= start_time)
+        if end_time:
+            stmt = stmt.where(AuditLog.timestamp < end_time)
+
+        if cursor:
+            last_ts, last_chat_id = decode_cursor(cursor)
+            stmt = stmt.where(tuple_(AuditLog.timestamp, AuditLog.chat_id) < tuple_(last_ts, last_chat_id))
+        elif not keyset:
+            stmt = stmt.offset(skip)
+
+        result = await session.execute(stmt.limit(limit + 1))
         audits = result.scalars().all()
+        page = audits[:limit]
         
-        return [
+        items = [
             {
                 "chat_id": log.chat_id,
                 "question": log.question,
@@ -54,5 +75,11 @@ async def list_audit_logs(limit: int = Query(50, ge=10, le=100), skip: int = Que
                 "timestamp": log.timestamp,
                 "feedback": log.feedback
             }
-            for log in audits
+            for log in page
         ]
+
+        if not (cursor or keyset):
+            return items
+
+        next_cursor = encode_cursor(page[-1].timestamp, page[-1].chat_id) if len(audits) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
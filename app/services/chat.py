@@ -1,18 +1,24 @@
-from app.services.embedding import get_embedding
-from app.services.vector_store import search_similar
+from app.services.embedding import get_embedding, get_query_embeddings
+from app.services.vector_store import (
+    search_similar, search_lexical, search_hybrid, reciprocal_rank_fusion, RETRIEVAL_MODE, RETRIEVAL_MODES,
+    HYBRID_VECTOR_K, HYBRID_LEXICAL_K, HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT, validate_filters
+)
 from app.services.audit import log_audit
 from app.services.action_logs import log_action
+from app.services.answer_cache import answer_cache, docs_fingerprint
+from app.services.checkpointer import checkpointer
 from app.models.type import ChatState
+import asyncio
 import uuid
 import time
+import json
 import os
 from loguru import logger
 from app.core.config import USER_PROMPT
+from app.core.metrics import timed, STAGE_SECONDS
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
 
 # LOAD ENVIRONMENT
 MODEL_TEMPERATURE = float(os.getenv("MODEL_TEMPERATURE"))
@@ -20,41 +26,188 @@ LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME")
 MAX_OUTPUT_TOKEN = int(os.getenv("MAX_OUTPUT_TOKEN"))
 TOP_K = int(os.getenv("TOP_K"))
 MIN_SIM_SCORE = float(os.getenv("MIN_SIM_SCORE"))
+# Extra search queries written by the LLM and retrieved in parallel, 0 disables query expansion
+CHAT_QUERY_EXPANSIONS = int(os.getenv("CHAT_QUERY_EXPANSIONS", 0))
+# Reasoning is skipped when the retrieved context is this short or the best match this similar
+FAST_PATH_MAX_CONTEXT_CHARS = int(os.getenv("FAST_PATH_MAX_CONTEXT_CHARS", 1500))
+FAST_PATH_MIN_SIMILARITY = float(os.getenv("FAST_PATH_MIN_SIMILARITY", 0.85))
+# One LLM call for reasoning + answer instead of reasoning_step then final_answer
+REASONING_SINGLE_CALL = os.getenv("REASONING_SINGLE_CALL", "true").lower() == "true"
+
+_chat_model = None
+
+def get_chat_model():
+    """LLM client, created on first use (see embedding.get_embedder)."""
+    global _chat_model
+    if _chat_model is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        _chat_model = ChatGoogleGenerativeAI(model=LLM_MODEL_NAME,
+                                             temperature=MODEL_TEMPERATURE,
+                                             model_kwargs={
+                                                 "streaming": True,
+                                                 "max_output_tokens": MAX_OUTPUT_TOKEN
+                                             })
+    return _chat_model
+
+# Nodes whose LLM tokens are the user-facing answer / the optional reasoning stream
+ANSWER_NODES = {"direct_answer", "final_answer"}
+REASONING_NODES = {"reasoning_step"}
+# Streams reasoning then answer, split at ANSWER_MARKER
+COMBINED_NODES = {"reasoning_answer"}
+ANSWER_MARKER = "FINAL ANSWER:"
+
+def _chunk_text(message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+async def _stream_completion(prompt: str) -> str:
+    """
+    Run the prompt through the chat model's astream. Inside a graph node the chunks are also
+    forwarded to graph.astream(stream_mode="messages"), which is what handle_chat relays.
+    """
+    text = ""
+    start = time.perf_counter()
+    first_chunk = True
+    with timed("llm.total"):
+        async for chunk in get_chat_model().astream([HumanMessage(content=prompt)]):
+            if first_chunk:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm.first_token", outcome="ok")
+                first_chunk = False
+            text += _chunk_text(chunk)
+    return text
 
-chat_model = ChatGoogleGenerativeAI(model=LLM_MODEL_NAME,
-                                    temperature=MODEL_TEMPERATURE,
-                                    model_kwargs={
-                                        "streaming": True,
-                                        "max_output_tokens": MAX_OUTPUT_TOKEN
-                                    })
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _context(docs: list[dict]) -> str:
+    return "\n".join([doc["content"] for doc in docs])
 
 async def direct_answer(state: ChatState):
-    context = "\n".join([doc["content"] for doc in state["docs"]])
-    prompt = f"Context:\n{context}\n\nQuestion: {state['query']}\nGive a concise answer."
-    res = await chat_model.ainvoke([HumanMessage(content=prompt)])
-    state["answer"] = res.content
-    return state
+    prompt = f"Context:\n{_context(state['docs'])}\n\nQuestion: {state['query']}\nGive a concise answer."
+    answer = await _stream_completion(prompt)
+    _remember_answer(state, answer)
+    return {"answer": answer}
+
+def retrieval_options(mode: str | None = None, vector_k: int | None = None, lexical_k: int | None = None,
+                      vector_weight: float | None = None, lexical_weight: float | None = None,
+                      filters: dict | None = None) -> dict:
+    """Per-request retrieval settings, falling back to the env defaults. `filters` restrict retrieval by metadata."""
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}, got '{mode}'")
+    return {
+        "mode": mode,
+        "vector_k": int(vector_k or HYBRID_VECTOR_K),
+        "lexical_k": int(lexical_k or HYBRID_LEXICAL_K),
+        "vector_weight": float(HYBRID_VECTOR_WEIGHT if vector_weight is None else vector_weight),
+        "lexical_weight": float(HYBRID_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight),
+        "filters": validate_filters(filters),
+    }
+
+async def _retrieve(query: str, query_emb: list[float] | None, options: dict) -> list[dict]:
+    if options["mode"] == "lexical":
+        docs = await search_lexical(query, k=TOP_K, filters=options["filters"])
+    elif options["mode"] == "hybrid":
+        docs = await search_hybrid(
+            query,
+            query_emb,
+            k=TOP_K,
+            min_sim_score=MIN_SIM_SCORE,
+            vector_k=options["vector_k"],
+            lexical_k=options["lexical_k"],
+            vector_weight=options["vector_weight"],
+            lexical_weight=options["lexical_weight"],
+            filters=options["filters"]
+        )
+    else:
+        docs = await search_similar(
+            query_emb=query_emb,
+            k=TOP_K,
+            min_sim_score=MIN_SIM_SCORE,
+            filters=options["filters"]
+        )
+    # Search functions report failures as {"status": "error", ...}; the chat goes on without context
+    return docs if isinstance(docs, list) else []
 
 async def retrieve_docs(state: ChatState):
-    logger.info("Retrieving similar documents...")
-    state["docs"] = await search_similar(
-        query_emb=await get_embedding(state["query"]),
-        k=TOP_K,
-        min_sim_score=MIN_SIM_SCORE
+    options = state.get("retrieval") or retrieval_options()
+    logger.info(f"Retrieving documents ({options['mode']})...")
+    # Also needed by the answer cache, whatever the retrieval mode
+    query_embedding = await get_embedding(state["query"])
+    return {
+        "query_embedding": query_embedding,
+        "docs": await _retrieve(state["query"], query_embedding, options)
+    }
+
+async def expand_query(state: ChatState):
+    """Runs alongside retrieve_docs: rewrite the question into CHAT_QUERY_EXPANSIONS alternative search queries."""
+    if CHAT_QUERY_EXPANSIONS <= 0:
+        return {"expanded_queries": []}
+    prompt = (
+        f"Write {CHAT_QUERY_EXPANSIONS} different search queries that would find documents answering "
+        f"this question. One query per line, no numbering, nothing else.\n\nQuestion: {state['query']}"
+    )
+    try:
+        with timed("llm.total"):
+            response = await get_chat_model().ainvoke([HumanMessage(content=prompt)])
+    except Exception as e:
+        logger.warning(f"Query expansion failed, using the original query only: {e}")
+        return {"expanded_queries": []}
+    lines = [line.strip(" -*\t") for line in _chunk_text(response).splitlines()]
+    queries = [q for q in dict.fromkeys(lines) if q and q != state["query"]]
+    return {"expanded_queries": queries[:CHAT_QUERY_EXPANSIONS]}
+
+async def retrieve_expanded(state: ChatState):
+    """Retrieval for every expanded query, concurrently, with one batched embedding call."""
+    queries = state.get("expanded_queries") or []
+    if not queries:
+        return {"expanded_docs": []}
+    options = state.get("retrieval") or retrieval_options()
+    embeddings = [None] * len(queries) if options["mode"] == "lexical" else await get_query_embeddings(queries)
+    results = await asyncio.gather(*(_retrieve(q, emb, options) for q, emb in zip(queries, embeddings)))
+    return {"expanded_docs": list(results)}
+
+async def merge_docs(state: ChatState):
+    """Fan-in of retrieve_docs and retrieve_expanded: fuse every result list with reciprocal rank fusion."""
+    expanded = [docs for docs in state.get("expanded_docs") or [] if docs]
+    if not expanded:
+        return {"docs": state["docs"]}
+    legs = [(state["docs"], 1.0)] + [(docs, 1.0) for docs in expanded]
+    return {"docs": reciprocal_rank_fusion(legs, k=TOP_K)}
+
+def _answer_mode(state: ChatState) -> str:
+    return "reasoning" if state.get("enable_reasoning", True) else "direct"
+
+async def lookup_answer_cache(state: ChatState):
+    cached = answer_cache.lookup(
+        state["query_embedding"],
+        mode=_answer_mode(state),
+        fingerprint=docs_fingerprint(state["docs"])
+    )
+    if not cached:
+        return {"cached": False}
+    logger.info(f"Answer cache hit (similarity={cached['similarity']:.3f})")
+    return {"cached": True, "answer": cached["answer"], "reasoning": cached["reasoning"]}
+
+def _remember_answer(state: ChatState, answer: str, reasoning: str = ""):
+    answer_cache.store(
+        state["query_embedding"],
+        mode=_answer_mode(state),
+        fingerprint=docs_fingerprint(state["docs"]),
+        answer=answer,
+        reasoning=reasoning
     )
-    return state
 
 async def reasoning_step(state: ChatState):
     logger.info("Reasoning with context...")
-    context = "\n".join([doc["content"] for doc in state["docs"]])
     reasoning_prompt = (
-        f"Context:\n{context}\n\n"
+        f"Context:\n{_context(state['docs'])}\n\n"
         f"Question: {state['query']}\n"
         "Explain step-by-step reasoning before giving the final answer."
     )
-    reasoning = await chat_model.ainvoke([HumanMessage(content=reasoning_prompt)])
-    state["reasoning"] = reasoning.content
-    return state
+    return {"reasoning": await _stream_completion(reasoning_prompt)}
 
 async def final_answer(state: ChatState):
     logger.info("Generating final concise answer...")
@@ -62,35 +215,130 @@ async def final_answer(state: ChatState):
         f"Reasoning:\n{state['reasoning']}\n\n"
         "Now give a short and direct answer based on the reasoning."
     )
-    answer = await chat_model.ainvoke([HumanMessage(content=answer_prompt)])
-    state["answer"] = answer.content
-    return state
+    answer = await _stream_completion(answer_prompt)
+    _remember_answer(state, answer, state["reasoning"])
+    return {"answer": answer}
+
+def split_reasoning_answer(text: str) -> tuple[str, str]:
+    """(reasoning, answer) of a reasoning_answer completion; without the marker it is all answer."""
+    reasoning, marker, answer = text.partition(ANSWER_MARKER)
+    if not marker:
+        return "", text.strip()
+    return reasoning.strip(), answer.strip()
+
+async def reasoning_answer(state: ChatState):
+    """Reasoning and final answer in one LLM call, separated by ANSWER_MARKER."""
+    logger.info("Reasoning and answering in one call...")
+    prompt = (
+        f"Context:\n{_context(state['docs'])}\n\n"
+        f"Question: {state['query']}\n"
+        "First explain your step-by-step reasoning. Then write a line starting with "
+        f"'{ANSWER_MARKER}' followed by a short and direct answer based on the reasoning."
+    )
+    reasoning, answer = split_reasoning_answer(await _stream_completion(prompt))
+    _remember_answer(state, answer, reasoning)
+    return {"reasoning": reasoning, "answer": answer}
+
+def is_easy(docs: list[dict]) -> bool:
+    """Fast path: little context to reason over, or a near-exact match, is answered directly."""
+    if len(_context(docs)) <= FAST_PATH_MAX_CONTEXT_CHARS:
+        return True
+    top = max((doc.get("similarity") or 0.0 for doc in docs), default=0.0)
+    return top >= FAST_PATH_MIN_SIMILARITY
 
 def should_reasoning(state: ChatState) -> str:
-    return "reasoning_step" if state.get("enable_reasoning", True) else "direct_answer"
+    if state.get("cached"):
+        return "cached"
+    if not state.get("enable_reasoning", True) or is_easy(state["docs"]):
+        return "direct_answer"
+    return "reasoning_answer" if REASONING_SINGLE_CALL else "reasoning_step"
 
 # Build Reasoning Graph
-workflow = StateGraph(ChatState)
-workflow.add_node("retrieve_docs", retrieve_docs)
-workflow.add_node("reasoning_step", reasoning_step)
-workflow.add_node("direct_answer", direct_answer)
-workflow.add_node("final_answer", final_answer)
-workflow.add_edge(START, "retrieve_docs")
-workflow.add_conditional_edges(
-    "retrieve_docs",
-    should_reasoning,
-    {
-        "reasoning_step": "reasoning_step",
-        "direct_answer": "direct_answer"
-    }
-)
-workflow.add_edge("reasoning_step", "final_answer")
-workflow.add_edge("direct_answer", END)
-workflow.add_edge("final_answer", END)
+# retrieve_docs and expand_query run concurrently; merge_docs waits for both retrieval branches
+def _build_graph():
+    workflow = StateGraph(ChatState)
+    nodes = [retrieve_docs, expand_query, retrieve_expanded, merge_docs, lookup_answer_cache,
+             reasoning_step, reasoning_answer, direct_answer, final_answer]
+    for node in nodes:
+        # Each node is timed as stage graph.<name>
+        workflow.add_node(node.__name__, timed(f"graph.{node.__name__}")(node))
+    workflow.add_edge(START, "retrieve_docs")
+    workflow.add_edge(START, "expand_query")
+    workflow.add_edge("expand_query", "retrieve_expanded")
+    workflow.add_edge(["retrieve_docs", "retrieve_expanded"], "merge_docs")
+    workflow.add_edge("merge_docs", "lookup_answer_cache")
+    workflow.add_conditional_edges(
+        "lookup_answer_cache",
+        should_reasoning,
+        {
+            "reasoning_step": "reasoning_step",
+            "reasoning_answer": "reasoning_answer",
+            "direct_answer": "direct_answer",
+            "cached": END
+        }
+    )
+    workflow.add_edge("reasoning_step", "final_answer")
+    workflow.add_edge("reasoning_answer", END)
+    workflow.add_edge("direct_answer", END)
+    workflow.add_edge("final_answer", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+_graph = None
+
+def get_graph():
+    """Compiled chat graph, built on first use."""
+    global _graph
+    if _graph is None:
+        _graph = _build_graph()
+    return _graph
+
+class _AnswerSplitter:
+    """
+    Splits the token stream of reasoning_answer at ANSWER_MARKER. Text that could be the
+    start of the marker is held back until the next chunk decides.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_answer = False
+        self.answer_started = False
+
+    def _answer(self, text: str) -> list[tuple[str, str]]:
+        # Drop the whitespace between the marker and the answer, however it is chunked
+        if not self.answer_started:
+            text = text.lstrip()
+            self.answer_started = bool(text)
+        return [("answer", text)] if text else []
+
+    def feed(self, text: str) -> list[tuple[str, str]]:
+        if self.in_answer:
+            return self._answer(text)
+        self.buffer += text
+        reasoning, marker, answer = self.buffer.partition(ANSWER_MARKER)
+        if marker:
+            self.in_answer = True
+            self.buffer = ""
+            return ([("reasoning", reasoning)] if reasoning else []) + self._answer(answer)
 
-graph = workflow.compile(checkpointer=MemorySaver())
+        hold = len(ANSWER_MARKER) - 1
+        ready, self.buffer = self.buffer[:-hold], self.buffer[-hold:]
+        return [("reasoning", ready)] if ready else []
 
-async def handle_chat(query: str, enable_reasoning: bool = True):
+    def flush(self) -> str:
+        """Text still held back when the stream ended without the marker."""
+        held, self.buffer = self.buffer, ""
+        return held
+
+async def handle_chat(query: str, enable_reasoning: bool = True, stream_reasoning: bool = False,
+                      retrieval: dict | None = None):
+    """
+    Run the chat graph and return an SSE generator.
+    Events: `token` (answer text as the LLM produces it), `reasoning` (only when
+    stream_reasoning is set), `reasoning_reset` (the reasoning streamed so far was in fact
+    the answer, sent as `token` next), `done` (chat_id and latencies) and `error`.
+    `retrieval` comes from retrieval_options(); None uses the env defaults.
+    """
+    retrieval = retrieval or retrieval_options()
     start = time.time()
     chat_id = str(uuid.uuid4())
 
@@ -99,40 +347,90 @@ async def handle_chat(query: str, enable_reasoning: bool = True):
         reasoning_text = ""
         first_token_latency = None
         docs = []
-        final_state = None
+        status = "success"
+        error_message = None
+        splitter = _AnswerSplitter()
+        reasoning_streamed = False
 
-        # Execute the graph and collect the final state
-        async for state in graph.astream(
-            {
-                "query": query,
+        try:
+            async for mode, chunk in get_graph().astream(
+                {
+                    "query": query,
+                    "chat_id": chat_id,
+                    "enable_reasoning": enable_reasoning,
+                    "retrieval": retrieval
+                },
+                config={"configurable": {"thread_id": chat_id}},
+                stream_mode=["messages", "updates"]
+            ):
+                if mode == "messages":
+                    message, metadata = chunk
+                    node = metadata.get("langgraph_node")
+                    content = _chunk_text(message)
+                    if not content:
+                        continue
+
+                    if node in ANSWER_NODES:
+                        pieces = [("answer", content)]
+                    elif node in REASONING_NODES:
+                        pieces = [("reasoning", content)]
+                    elif node in COMBINED_NODES:
+                        pieces = splitter.feed(content)
+                    else:
+                        continue
+
+                    for kind, text in pieces:
+                        if kind == "answer":
+                            if first_token_latency is None:
+                                first_token_latency = int((time.time() - start) * 1000)
+                            output += text
+                            yield _sse("token", {"content": text})
+                        else:
+                            reasoning_text += text
+                            if stream_reasoning:
+                                reasoning_streamed = True
+                                yield _sse("reasoning", {"content": text})
+                    continue
+
+                for node, update in chunk.items():
+                    if node == "merge_docs" and update.get("docs"):
+                        docs = [doc["content"] for doc in update["docs"]]
+                    elif node == "lookup_answer_cache" and update.get("cached"):
+                        # Nothing to stream from the LLM, send the stored answer as one token
+                        first_token_latency = int((time.time() - start) * 1000)
+                        output = update.get("answer", "")
+                        reasoning_text = update.get("reasoning", "")
+                        if stream_reasoning and reasoning_text:
+                            yield _sse("reasoning", {"content": reasoning_text})
+                        yield _sse("token", {"content": output})
+                    elif node in COMBINED_NODES and not splitter.in_answer:
+                        # The model never wrote the marker: its whole output is the answer, including
+                        # what was streamed as reasoning and the tail the splitter held back
+                        splitter.flush()
+                        if reasoning_streamed:
+                            yield _sse("reasoning_reset", {})
+                        first_token_latency = int((time.time() - start) * 1000)
+                        output = update.get("answer", "")
+                        reasoning_text = update.get("reasoning", "")
+                        yield _sse("token", {"content": output})
+
+        except Exception as e:
+            logger.error(f"Chat {chat_id} failed: {e}")
+            status = "failed"
+            error_message = str(e)
+            yield _sse("error", {"chat_id": chat_id, "message": error_message})
+
+        total_latency = int((time.time() - start) * 1000)
+        outcome = "ok" if status == "success" else "error"
+        if first_token_latency is not None:
+            STAGE_SECONDS.observe(first_token_latency / 1000, stage="chat.first_token", outcome=outcome)
+        STAGE_SECONDS.observe(total_latency / 1000, stage="chat.total", outcome=outcome)
+        if status == "success":
+            yield _sse("done", {
                 "chat_id": chat_id,
-                "enable_reasoning": enable_reasoning
-            },
-            config={"configurable": {"thread_id": chat_id}}
-        ):
-            # Update final_state with the latest state
-            final_state = state
-            
-            # Capture docs as soon as retrieved
-            if "retrieve_docs" in state and state["retrieve_docs"].get("docs"):
-                docs = [doc["content"] for doc in state["retrieve_docs"]["docs"]]
-
-        # After graph execution, get the final answer and stream it
-        if final_state:
-            # Extract the final answer based on the path taken
-            if enable_reasoning and "final_answer" in final_state:
-                answer_content = final_state["final_answer"].get("answer", "")
-                reasoning_text = final_state["final_answer"].get("reasoning", "")
-            elif "direct_answer" in final_state:
-                answer_content = final_state["direct_answer"].get("answer", "")
-            else:
-                answer_content = ""
-
-            # Stream the answer token by token
-            first_token_latency = int((time.time() - start) * 1000)
-            for char in answer_content:
-                yield char
-                output += char
+                "first_token_latency_ms": first_token_latency,
+                "latency_ms": total_latency
+            })
 
         # Log audit information
         await log_audit(
@@ -142,8 +440,7 @@ async def handle_chat(query: str, enable_reasoning: bool = True):
             retrieved_docs=docs,
             latency_ms=first_token_latency
         )
-        
-        total_latency = int((time.time() - start) * 1000)
+
         await log_action(
             action_type="chat",
             resource_type="llm",
@@ -151,6 +448,7 @@ async def handle_chat(query: str, enable_reasoning: bool = True):
             request_data={
                 "query": query,
                 "enable_reasoning": enable_reasoning,
+                "retrieval": retrieval,
                 "docs": docs
             },
             response_data={
@@ -158,7 +456,8 @@ async def handle_chat(query: str, enable_reasoning: bool = True):
                 "reasoning": reasoning_text
             },
             latency_ms=total_latency,
-            status="success"
+            status=status,
+            error_message=error_message
         )
 
-    return generator()
\ No newline at end of file
+    return generator()
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from langgraph.checkpoint.memory import InMemorySaver
+from loguru import logger
+import threading
+import time
+import os
+
+# none: no checkpoints, memory: bounded in-process store, postgres: durable store shared by all workers
+CHAT_CHECKPOINTER = os.getenv("CHAT_CHECKPOINTER", "memory").lower()
+CHAT_CHECKPOINT_MAX_THREADS = int(os.getenv("CHAT_CHECKPOINT_MAX_THREADS", 1000))
+CHAT_CHECKPOINT_TTL = int(os.getenv("CHAT_CHECKPOINT_TTL", 600))
+
+CHECKPOINTERS = ("none", "memory", "postgres")
+
+if CHAT_CHECKPOINTER not in CHECKPOINTERS:
+    raise ValueError(f"CHAT_CHECKPOINTER must be one of {CHECKPOINTERS}, got '{CHAT_CHECKPOINTER}'")
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    InMemorySaver keeping at most `max_threads` threads, each for at most `ttl` seconds
+    after its last checkpoint. Every chat is its own thread, so without a bound the
+    state of every chat ever served stays in memory.
+    """
+
+    def __init__(self, max_threads: int, ttl: float | None):
+        super().__init__()
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.evicted = 0
+        self._threads: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._threads[thread_id] = time.monotonic()
+            self._threads.move_to_end(thread_id)
+            expired = self._expired_threads()
+        for old_thread in expired:
+            self.delete_thread(old_thread)
+        return result
+
+    def delete_thread(self, thread_id: str):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+    def _expired_threads(self) -> list[str]:
+        """Oldest threads over the size bound plus the ones past their TTL. Caller holds the lock."""
+        now = time.monotonic()
+        expired = []
+        for thread_id, touched_at in self._threads.items():
+            over_size = len(self._threads) - len(expired) > self.max_threads
+            over_ttl = self.ttl is not None and now - touched_at > self.ttl
+            if not (over_size or over_ttl):
+                break
+            expired.append(thread_id)
+        self.evicted += len(expired)
+        return expired
+
+    def stats(self) -> dict:
+        return {
+            "type": "memory",
+            "threads": len(self._threads),
+            "max_threads": self.max_threads,
+            "ttl": self.ttl,
+            "evicted": self.evicted,
+            "checkpoints": sum(len(checkpoints) for ns in self.storage.values() for checkpoints in ns.values()),
+            "writes": sum(len(writes) for writes in self.writes.values()),
+            "blobs": len(self.blobs),
+            "approx_bytes": _payload_bytes(self.storage) + _payload_bytes(self.writes) + _payload_bytes(self.blobs),
+        }
+
+def _payload_bytes(value) -> int:
+    """Bytes of the serialized payloads held in the saver's nested dicts/tuples."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_payload_bytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_payload_bytes(v) for v in value)
+    return 0
+
+_postgres_pool = None
+
+def _postgres_checkpointer():
+    # Optional dependency: only needed with CHAT_CHECKPOINTER=postgres
+    try:
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        from psycopg_pool import AsyncConnectionPool
+        from psycopg.rows import dict_row
+    except ImportError as e:
+        raise RuntimeError(
+            "CHAT_CHECKPOINTER=postgres needs: pip install langgraph-checkpoint-postgres 'psycopg[binary,pool]'"
+        ) from e
+
+    global _postgres_pool
+    # psycopg takes a plain postgresql:// URL, not the SQLAlchemy driver form
+    conninfo = os.getenv("DB_URL").replace("postgresql+asyncpg://", "postgresql://", 1)
+    _postgres_pool = AsyncConnectionPool(
+        conninfo,
+        open=False,
+        max_size=int(os.getenv("CHAT_CHECKPOINT_POOL_SIZE", 5)),
+        kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+    )
+    return AsyncPostgresSaver(_postgres_pool)
+
+def _build_checkpointer():
+    if CHAT_CHECKPOINTER == "none":
+        return None
+    if CHAT_CHECKPOINTER == "postgres":
+        return _postgres_checkpointer()
+    return BoundedMemorySaver(CHAT_CHECKPOINT_MAX_THREADS, CHAT_CHECKPOINT_TTL or None)
+
+checkpointer = _build_checkpointer()
+
+async def start_checkpointer():
+    """Open the Postgres pool and create the checkpoint tables. No-op for the other modes."""
+    if _postgres_pool is not None:
+        await _postgres_pool.open()
+        await checkpointer.setup()
+        logger.info("Chat checkpoints stored in Postgres")
+
+async def stop_checkpointer():
+    if _postgres_pool is not None:
+        await _postgres_pool.close()
+
+def checkpointer_stats() -> dict:
+    if isinstance(checkpointer, BoundedMemorySaver):
+        return checkpointer.stats()
+    return {"type": CHAT_CHECKPOINTER}
@@ -1,8 +1,279 @@
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.dialects.postgresql import insert
+from loguru import logger
+from datetime import timedelta
+from app.core.cache import LRUCache
+from app.core.database import engine, get_session
+from app.core.metrics import timed
+from app.models.embedding_cache import EmbeddingCache
+from app.models.document import EMBEDDING_DIM
+import numpy as np
+import asyncio
+import hashlib
+import unicodedata
+import time
 import os
 
-# Ensure your API key is set in env
-embedder = GoogleGenerativeAIEmbeddings(model=os.getenv("EMBEDDING_MODEL_NAME"), google_api_key=os.getenv("GOOGLE_API_KEY"))
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME")
+# Ask the API for EMBEDDING_DIM dimensions (output_dimensionality); only for models that support it
+EMBEDDING_REQUEST_DIM = os.getenv("EMBEDDING_REQUEST_DIM", "false").lower() == "true"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 2048))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 3600))
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "false").lower() == "true"
+EMBEDDING_CACHE_PERSIST_TTL = int(os.getenv("EMBEDDING_CACHE_PERSIST_TTL", 0))
+# Newest rows kept in embedding_cache by the periodic prune, 0 = no limit
+EMBEDDING_CACHE_PERSIST_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_PERSIST_MAX_ROWS", 100_000))
+# Seconds between reads of the vector column dimensions from the database (see embedding_dims)
+EMBEDDING_LAYOUT_REFRESH_INTERVAL = float(os.getenv("EMBEDDING_LAYOUT_REFRESH_INTERVAL", 10))
+
+# Filled by app/scripts/reindex_embeddings.py while documents are re-embedded at another dimension
+SHADOW_EMBEDDING_COLUMN = "embedding_next"
+
+_embedder = None
+
+def get_embedder():
+    """
+    Embedding client, created on first use: importing langchain_google_genai and building
+    the client is a large part of the app's import time, and not every process embeds.
+    """
+    global _embedder
+    if _embedder is None:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        # Ensure your API key is set in env
+        _embedder = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=os.getenv("GOOGLE_API_KEY"))
+    return _embedder
+
+# Shared by every caller so concurrent uploads cannot flood the embedding API
+_embedding_semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+
+# Query embeddings only: document ingestion goes through get_embeddings and is not cached
+_query_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL or None)
+_persistent_stats = {"hits": 0, "misses": 0, "errors": 0}
+
+# Dimensions of the vector columns as they are in the database, EMBEDDING_DIM until first read.
+# shadow_dim is set while a reindex fills SHADOW_EMBEDDING_COLUMN for this process's model.
+_layout = {"dim": EMBEDDING_DIM, "shadow_dim": None, "checked_at": None}
+
+async def refresh_embedding_layout(force: bool = False):
+    """
+    Re-read the dimensions of documents.embedding and of the shadow column, at most every
+    EMBEDDING_LAYOUT_REFRESH_INTERVAL seconds unless `force`. The app follows a reindex swap
+    this way instead of failing until it is redeployed with the new EMBEDDING_DIM.
+    """
+    now = time.monotonic()
+    if not force and _layout["checked_at"] is not None and now - _layout["checked_at"] < EMBEDDING_LAYOUT_REFRESH_INTERVAL:
+        return
+    _layout["checked_at"] = now
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(text("""
+                SELECT attname, atttypmod, col_description(attrelid, attnum) AS model
+                FROM pg_attribute
+                WHERE attrelid = to_regclass('documents') AND attname IN ('embedding', :shadow) AND NOT attisdropped
+            """), {"shadow": SHADOW_EMBEDDING_COLUMN})
+            columns = {row.attname: row for row in result}
+    except Exception as e:
+        logger.warning(f"Could not read the embedding column dimensions: {e}")
+        return
+
+    main = columns.get("embedding")
+    if main is not None and main.atttypmod > 0:
+        _layout["dim"] = main.atttypmod
+    if main is not None and main.model not in (None, EMBEDDING_MODEL_NAME):
+        logger.warning(f"documents.embedding holds {main.model} vectors, this process embeds with "
+                       f"{EMBEDDING_MODEL_NAME}: deploy it with EMBEDDING_MODEL_NAME={main.model}")
+    shadow = columns.get(SHADOW_EMBEDDING_COLUMN)
+    # The reindex script tags the shadow column with its model: vectors of another model cannot go in
+    same_model = shadow is not None and shadow.model in (None, EMBEDDING_MODEL_NAME)
+    _layout["shadow_dim"] = shadow.atttypmod if same_model and shadow.atttypmod > 0 else None
+
+def embedding_dims() -> tuple[int, int | None]:
+    """(dimension of documents.embedding, of the shadow column or None), as last read."""
+    return _layout["dim"], _layout["shadow_dim"]
+
+def _embed_dim() -> int:
+    # During a reindex embed once at the larger dimension; each column gets its own truncation
+    dim, shadow_dim = embedding_dims()
+    return max(dim, shadow_dim or 0)
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def _cache_key(text: str) -> str:
+    return hashlib.sha256(f"{EMBEDDING_MODEL_NAME}\x00{_embed_dim()}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+def fit_dimension(vec: list[float], dim: int) -> list[float]:
+    """
+    Matryoshka truncation: keep the first `dim` values and re-normalize to unit length,
+    so cosine distances stay comparable. Vectors already of size `dim` are returned as is.
+    """
+    if len(vec) == dim:
+        return vec
+    if len(vec) < dim:
+        raise ValueError(f"Embedding has {len(vec)} dimensions, {dim} are needed")
+    arr = np.asarray(vec[:dim], dtype=np.float64)
+    norm = np.linalg.norm(arr)
+    return (arr / norm if norm else arr).tolist()
+
+def _dim_kwargs(dim: int) -> dict:
+    return {"output_dimensionality": dim} if EMBEDDING_REQUEST_DIM else {}
+
+@timed("embedding.query")
+async def _embed_query(text: str) -> list[float]:
+    dim = _embed_dim()
+    vec = await asyncio.to_thread(get_embedder().embed_query, text, **_dim_kwargs(dim))
+    return fit_dimension(vec, dim)
+
+@timed("embedding.documents")
+async def _embed_documents(texts: list[str], task_type: str | None = None, dim: int | None = None) -> list[list[float]]:
+    dim = dim or _embed_dim()
+    vectors = await asyncio.to_thread(get_embedder().embed_documents, texts, task_type=task_type, **_dim_kwargs(dim))
+    return [fit_dimension(vec, dim) for vec in vectors]
+
+async def _load_persisted_many(keys: list[str]) -> dict:
+    """{key: embedding} for the keys found in the embedding_cache table, in one query."""
+    try:
+        async with get_session() as session:
+            stmt = select(EmbeddingCache.key, EmbeddingCache.embedding).where(EmbeddingCache.key.in_(keys))
+            if EMBEDDING_CACHE_PERSIST_TTL:
+                stmt = stmt.where(EmbeddingCache.created_at > func.now() - timedelta(seconds=EMBEDDING_CACHE_PERSIST_TTL))
+            result = await session.execute(stmt)
+            found = {row.key: [float(x) for x in row.embedding] for row in result}
+    except Exception as e:
+        _persistent_stats["errors"] += 1
+        logger.warning(f"Embedding cache lookup failed: {e}")
+        return {}
+
+    _persistent_stats["hits"] += len(found)
+    _persistent_stats["misses"] += len(keys) - len(found)
+    return found
+
+async def _load_persisted(key: str) -> list[float] | None:
+    return (await _load_persisted_many([key])).get(key)
+
+async def _persist_many(vectors: dict):
+    """Upsert {key: embedding} into the embedding_cache table with one statement."""
+    try:
+        async with get_session() as session:
+            stmt = insert(EmbeddingCache).values([
+                {"key": key, "model": EMBEDDING_MODEL_NAME, "embedding": vec} for key, vec in vectors.items()
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["key"],
+                set_={"embedding": stmt.excluded.embedding, "created_at": func.now()}
+            )
+            await session.execute(stmt)
+            await session.commit()
+    except Exception as e:
+        _persistent_stats["errors"] += 1
+        logger.warning(f"Embedding cache write failed: {e}")
+
+async def prune_embedding_cache(conn) -> int:
+    """
+    Delete embedding_cache rows older than EMBEDDING_CACHE_PERSIST_TTL and the oldest rows
+    beyond EMBEDDING_CACHE_PERSIST_MAX_ROWS. Run periodically by the partition maintainer.
+    """
+    deleted = 0
+    if EMBEDDING_CACHE_PERSIST_TTL:
+        result = await conn.execute(delete(EmbeddingCache).where(
+            EmbeddingCache.created_at <= func.now() - timedelta(seconds=EMBEDDING_CACHE_PERSIST_TTL)
+        ))
+        deleted += result.rowcount
+    if EMBEDDING_CACHE_PERSIST_MAX_ROWS:
+        overflow = (
+            select(EmbeddingCache.key)
+            .order_by(EmbeddingCache.created_at.desc())
+            .offset(EMBEDDING_CACHE_PERSIST_MAX_ROWS)
+            .scalar_subquery()
+        )
+        result = await conn.execute(delete(EmbeddingCache).where(EmbeddingCache.key.in_(overflow)))
+        deleted += result.rowcount
+    if deleted:
+        logger.info(f"Pruned {deleted} rows from embedding_cache")
+    return deleted
+
+async def _persist(key: str, vec: list[float]):
+    await _persist_many({key: vec})
 
 async def get_embedding(text: str) -> list[float]:
-    return await embedder.aembed_query(text)
+    await refresh_embedding_layout()
+    key = _cache_key(text)
+    vec = _query_cache.get(key)
+    if vec is not None:
+        return vec
+
+    if EMBEDDING_CACHE_PERSIST:
+        vec = await _load_persisted(key)
+        if vec is not None:
+            _query_cache.set(key, vec)
+            return vec
+
+    vec = await _embed_query(text)
+    _query_cache.set(key, vec)
+    if EMBEDDING_CACHE_PERSIST:
+        await _persist(key, vec)
+    return vec
+
+async def _embed_query_batch(texts: list[str]) -> list[list[float]]:
+    # Same task type as embed_query, so the vectors (and cache entries) are interchangeable
+    async with _embedding_semaphore:
+        return await _embed_documents(texts, task_type="RETRIEVAL_QUERY")
+
+async def get_query_embeddings(texts: list[str]) -> list[list[float]]:
+    """
+    Query embeddings for many texts: cached ones are reused and all the others are
+    embedded with one batched request per EMBEDDING_BATCH_SIZE texts. Order matches `texts`.
+    """
+    await refresh_embedding_layout()
+    keys = [_cache_key(text) for text in texts]
+    vectors = {}
+    for key in set(keys):
+        vec = _query_cache.get(key)
+        if vec is not None:
+            vectors[key] = vec
+
+    missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+    if missing and EMBEDDING_CACHE_PERSIST:
+        found = await _load_persisted_many(missing)
+        for key, vec in found.items():
+            _query_cache.set(key, vec)
+        vectors.update(found)
+        missing = [key for key in missing if key not in found]
+
+    if missing:
+        text_by_key = dict(zip(keys, texts))
+        batches = [missing[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(missing), EMBEDDING_BATCH_SIZE)]
+        results = await asyncio.gather(*(_embed_query_batch([text_by_key[k] for k in batch]) for batch in batches))
+        embedded = dict(zip(missing, (vec for batch in results for vec in batch)))
+        for key, vec in embedded.items():
+            _query_cache.set(key, vec)
+        vectors.update(embedded)
+        if EMBEDDING_CACHE_PERSIST:
+            await _persist_many(embedded)
+
+    return [vectors[key] for key in keys]
+
+def embedding_cache_stats() -> dict:
+    stats = {"memory": _query_cache.stats()}
+    if EMBEDDING_CACHE_PERSIST:
+        stats["persistent"] = dict(_persistent_stats)
+    return stats
+
+async def _embed_batch(texts: list[str], dim: int) -> list[list[float]]:
+    async with _embedding_semaphore:
+        return await _embed_documents(texts, dim=dim)
+
+async def get_embeddings(texts: list[str], batch_size: int = EMBEDDING_BATCH_SIZE, dim: int | None = None) -> list[list[float]]:
+    """
+    Embed many texts with one request per batch of `batch_size`.
+    Batches run concurrently, bounded by EMBEDDING_MAX_CONCURRENCY. Order of the result matches `texts`.
+    `dim` defaults to what the vector columns currently need (see embedding_dims).
+    """
+    if dim is None:
+        await refresh_embedding_layout()
+        dim = _embed_dim()
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    results = await asyncio.gather(*(_embed_batch(batch, dim) for batch in batches))
+    return [vec for batch in results for vec in batch]
@@ -1,6 +1,10 @@
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import List
+from langchain_core.documents import Document
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from typing import AsyncIterator, Callable, List
+from pypdf import PdfReader
+import multiprocessing
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -8,27 +12,137 @@ load_dotenv()
 
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 500))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 100))
+EXTRACTOR_WORKERS = int(os.getenv("EXTRACTOR_WORKERS", 2))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 20))
+TEXT_SEGMENT_BYTES = int(os.getenv("TEXT_SEGMENT_BYTES", 1_000_000))
+# Parsed-but-unconsumed tasks per file; bounds memory whatever the file size
+EXTRACT_MAX_PENDING = int(os.getenv("EXTRACT_MAX_PENDING", EXTRACTOR_WORKERS * 2))
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+_text_splitter = None
+_pool: ProcessPoolExecutor | None = None
+
+def get_text_splitter():
+    """Created on first use, so only the pool workers that split text import langchain's splitters."""
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        _text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return _text_splitter
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and executor threads is unsafe
+        _pool = ProcessPoolExecutor(max_workers=EXTRACTOR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+# ---- Run inside the process pool ----
+
+def _pdf_page_count(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+def _split_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    reader = PdfReader(file_path)
+    pages = [
+        Document(page_content=reader.pages[i].extract_text() or "", metadata={"page": i})
+        for i in range(start, end)
+    ]
+    return [chunk.page_content for chunk in get_text_splitter().split_documents(pages)]
+
+def _text_segments(file_path: str, segment_bytes: int) -> List[tuple[int, int]]:
+    """Byte ranges of about `segment_bytes`, each ending on a line break so no line is cut."""
+    size = os.path.getsize(file_path)
+    ranges, start = [], 0
+    with open(file_path, "rb") as f:
+        while start < size:
+            end = min(start + segment_bytes, size)
+            if end < size:
+                f.seek(end)
+                end += len(f.readline())
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _split_text_segment(file_path: str, start: int, end: int) -> List[str]:
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8", errors="ignore")
+    return get_text_splitter().split_text(text)
+
+# ---- Event loop side ----
+
+# Called with (parse tasks done, parse tasks in total, chunks produced so far)
+ProgressCallback = Callable[[int, int, int], None]
+
+async def _stream_tasks(tasks: list[tuple], on_progress: ProgressCallback | None = None) -> AsyncIterator[str]:
+    """Run (fn, *args) tasks in the pool, at most EXTRACT_MAX_PENDING ahead, yielding chunks in order."""
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    todo = iter(tasks)
+    pending = deque()
+
+    def submit_next():
+        task = next(todo, None)
+        if task is not None:
+            pending.append(loop.run_in_executor(pool, *task))
+
+    done = produced = 0
+    try:
+        for _ in range(EXTRACT_MAX_PENDING):
+            submit_next()
+        while pending:
+            chunks = await pending.popleft()
+            submit_next()
+            done += 1
+            produced += len(chunks)
+            if on_progress:
+                on_progress(done, len(tasks), produced)
+            for chunk in chunks:
+                yield chunk
+    finally:
+        for future in pending:
+            future.cancel()
+
+async def iter_chunks(file_path: str, file_ext: str, on_progress: ProgressCallback | None = None) -> AsyncIterator[str]:
+    """
+    Parse and chunk a file in the process pool as a stream: chunks of the first pages
+    are available while later pages are still being parsed. `on_progress` is called
+    as each parse task (a run of PDF pages or a text segment) completes.
+    """
+    loop = asyncio.get_running_loop()
+    if file_ext == ".pdf":
+        page_count = await loop.run_in_executor(get_pool(), _pdf_page_count, file_path)
+        tasks = [
+            (_split_pdf_pages, file_path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+            for start in range(0, page_count, PDF_PAGES_PER_TASK)
+        ]
+    elif file_ext in [".txt", ".md"]:
+        ranges = await loop.run_in_executor(get_pool(), _text_segments, file_path, TEXT_SEGMENT_BYTES)
+        tasks = [(_split_text_segment, file_path, start, end) for start, end in ranges]
+    else:
+        return
+
+    async for chunk in _stream_tasks(tasks, on_progress):
+        yield chunk
+
+async def iter_documents(file_path: str, file_ext: str, file_name: str,
+                         on_progress: ProgressCallback | None = None) -> AsyncIterator[dict]:
+    """Stream of upsert_docs-ready dicts for a file."""
+    async for chunk in iter_chunks(file_path, file_ext, on_progress):
+        yield {"text": chunk, "extra_info": {"filename": file_name}}
 
 async def extract_text_from_pdf(file_path: str) -> List[str]:
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
-    chunks = text_splitter.split_documents(documents)
-    return [chunk.page_content for chunk in chunks]
+    return [chunk async for chunk in iter_chunks(file_path, ".pdf")]
 
 async def extract_text_from_txt(file_path: str) -> List[str]:
-    loader = TextLoader(file_path, encoding="utf-8")
-    documents = loader.load()
-    chunks = text_splitter.split_documents(documents)
-    return [chunk.page_content for chunk in chunks]
+    return [chunk async for chunk in iter_chunks(file_path, ".txt")]
 
 async def extract_text(file_path: str, file_ext: str, file_name:str):
     """Auto choose extraction method based on file type."""
-    if file_ext == ".pdf":
-        docs = await extract_text_from_pdf(file_path)
-    elif file_ext in [".txt", ".md"]:
-        docs = await extract_text_from_txt(file_path)
-    else:
-        return []
-    return [{"text": doc, "extra_info": {"filename": file_name}} for doc in docs]
+    return [doc async for doc in iter_documents(file_path, file_ext, file_name)]
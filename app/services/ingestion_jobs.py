@@ -0,0 +1,347 @@
+from sqlalchemy import select, update, or_, and_, func
+from fastapi import HTTPException, UploadFile
+from loguru import logger
+from datetime import timedelta
+from typing import AsyncIterator
+from app.core.database import get_session
+from app.models.ingestion_job import IngestionJob
+from app.services.embedding import EMBEDDING_BATCH_SIZE
+from app.services.file_extractor import iter_documents
+from app.services.vector_store import upsert_docs, source_documents, prune_source
+from app.services.vector_index import index_maintainer, VECTOR_ANALYZE_MIN_CHANGES
+import asyncio
+import shutil
+import socket
+import uuid
+import os
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", 2))
+INGEST_STALE_AFTER = int(os.getenv("INGEST_STALE_AFTER", 300))
+# Must stay well below INGEST_STALE_AFTER, or running jobs are taken over by another worker
+INGEST_HEARTBEAT_INTERVAL = float(os.getenv("INGEST_HEARTBEAT_INTERVAL", 30))
+INGEST_MAX_FAILURES_RECORDED = int(os.getenv("INGEST_MAX_FAILURES_RECORDED", 100))
+# Must be shared storage when several replicas run workers
+INGEST_UPLOAD_DIR = os.getenv("INGEST_UPLOAD_DIR", "/tmp/ingestion_jobs")
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md")
+
+def _job_to_dict(job: IngestionJob) -> dict:
+    elapsed = None
+    if job.started_at:
+        end = job.finished_at or job.heartbeat_at or job.started_at
+        elapsed = (end - job.started_at).total_seconds()
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "filename": job.filename,
+        "source": job.source,
+        "total_chunks": job.total_chunks,
+        # Upload jobs extrapolate the total from the parse tasks done so far until they complete
+        "total_chunks_estimated": job.kind == "upload" and job.status != "completed",
+        "processed_chunks": job.processed_chunks,
+        "succeeded_chunks": job.succeeded_chunks,
+        "failed_chunks": job.failed_chunks,
+        "progress": round(job.processed_chunks / job.total_chunks, 4) if job.total_chunks else None,
+        "throughput_chunks_per_s": round(job.processed_chunks / elapsed, 2) if elapsed else None,
+        "failures": job.failures,
+        "cancel_requested": job.cancel_requested,
+        "attempts": job.attempts,
+        "error_message": job.error_message,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+async def _create_job(**values) -> dict:
+    async with get_session() as session:
+        job = IngestionJob(id=str(uuid.uuid4()), status="queued", processed_chunks=0,
+                           succeeded_chunks=0, failed_chunks=0, failures=[], attempts=0, **values)
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return _job_to_dict(job)
+
+async def submit_upload_job(file: UploadFile, source: str | None = None) -> dict:
+    file_ext = os.path.splitext(file.filename)[-1].lower()
+    if file_ext not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type '{file_ext}'")
+
+    os.makedirs(INGEST_UPLOAD_DIR, exist_ok=True)
+    file_path = os.path.join(INGEST_UPLOAD_DIR, f"{uuid.uuid4()}{file_ext}")
+    with open(file_path, "wb") as out:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, out)
+
+    return await _create_job(kind="upload", filename=file.filename, source=source or file.filename, file_path=file_path)
+
+async def submit_update_job(docs: list[dict]) -> dict:
+    return await _create_job(kind="update", payload=docs, total_chunks=len(docs))
+
+async def get_job(job_id: str) -> dict:
+    async with get_session() as session:
+        job = await session.get(IngestionJob, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+        return _job_to_dict(job)
+
+async def list_jobs(status: str | None = None, limit: int = 50) -> list[dict]:
+    async with get_session() as session:
+        stmt = select(IngestionJob).order_by(IngestionJob.created_at.desc()).limit(limit)
+        if status:
+            stmt = stmt.where(IngestionJob.status == status)
+        result = await session.execute(stmt)
+        return [_job_to_dict(job) for job in result.scalars().all()]
+
+async def cancel_job(job_id: str) -> dict:
+    """Queued jobs are cancelled at once; running ones stop after their current batch."""
+    async with get_session() as session:
+        job = await session.get(IngestionJob, job_id, with_for_update=True)
+        if not job:
+            raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = func.now()
+        elif job.status == "running":
+            job.cancel_requested = True
+        else:
+            raise HTTPException(status_code=409, detail=f"Job '{job_id}' is already {job.status}")
+        await session.commit()
+        await session.refresh(job)
+        return _job_to_dict(job)
+
+async def resume_job(job_id: str) -> dict:
+    """Queue a failed or cancelled job again; it continues after its last processed chunk."""
+    async with get_session() as session:
+        job = await session.get(IngestionJob, job_id, with_for_update=True)
+        if not job:
+            raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+        if job.status not in ("failed", "cancelled"):
+            raise HTTPException(status_code=409, detail=f"Only failed or cancelled jobs can be resumed, job is {job.status}")
+        job.status = "queued"
+        job.cancel_requested = False
+        job.error_message = None
+        job.finished_at = None
+        await session.commit()
+        await session.refresh(job)
+        return _job_to_dict(job)
+
+async def _claim_job(worker_id: str) -> IngestionJob | None:
+    """
+    Take the oldest queued job, or a running one whose worker stopped heartbeating.
+    SKIP LOCKED lets workers on every replica poll the same table without contention.
+    """
+    async with get_session(isolated=True) as session:
+        stale = func.now() - timedelta(seconds=INGEST_STALE_AFTER)
+        stmt = (
+            select(IngestionJob)
+            .where(or_(
+                IngestionJob.status == "queued",
+                and_(IngestionJob.status == "running", IngestionJob.heartbeat_at < stale)
+            ))
+            .order_by(IngestionJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = (await session.execute(stmt)).scalar_one_or_none()
+        if not job:
+            return None
+        job.status = "running"
+        job.worker_id = worker_id
+        job.attempts += 1
+        job.started_at = job.started_at or func.now()
+        job.heartbeat_at = func.now()
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+def _job_source(job: IngestionJob) -> str:
+    # Jobs queued before the source column existed synced under their file name
+    return job.source or job.filename
+
+async def _job_documents(job: IngestionJob, on_progress=None) -> AsyncIterator[dict]:
+    if job.kind == "upload":
+        file_ext = os.path.splitext(job.file_path)[-1].lower()
+        docs = iter_documents(file_path=job.file_path, file_ext=file_ext, file_name=job.filename,
+                              on_progress=on_progress)
+        async for doc in source_documents(_job_source(job), docs):
+            yield doc
+    else:
+        for doc in job.payload or []:
+            yield doc
+
+def _owned_by(job_id: str, worker_id: str):
+    # Progress and status are only written by the worker holding the job
+    return and_(IngestionJob.id == job_id, IngestionJob.worker_id == worker_id, IngestionJob.status == "running")
+
+async def _heartbeat(job_id: str, worker_id: str, lost: asyncio.Event):
+    """Keep heartbeat_at fresh for the whole run; sets `lost` once another worker has taken the job."""
+    while True:
+        await asyncio.sleep(INGEST_HEARTBEAT_INTERVAL)
+        try:
+            async with get_session() as session:
+                result = await session.execute(
+                    update(IngestionJob).where(_owned_by(job_id, worker_id)).values(heartbeat_at=func.now())
+                )
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Heartbeat of ingestion job {job_id} failed: {e}")
+            continue
+        if result.rowcount == 0:
+            lost.set()
+            return
+
+async def _record_batch(job_id: str, worker_id: str, results: list[dict], batch_size: int,
+                        total_chunks: int | None = None) -> str | None:
+    """
+    Save progress of one batch and heartbeat. Returns "cancelled" when cancellation was
+    requested, "lost" when the job is no longer held by this worker, None otherwise.
+    """
+    failed = [r for r in results if r.get("action") == "failed"]
+    async with get_session() as session:
+        result = await session.execute(select(IngestionJob).where(_owned_by(job_id, worker_id)).with_for_update())
+        job = result.scalar_one_or_none()
+        if job is None:
+            return "lost"
+        job.processed_chunks += batch_size
+        job.succeeded_chunks += batch_size - len(failed)
+        job.failed_chunks += len(failed)
+        if total_chunks is not None:
+            job.total_chunks = max(total_chunks, job.processed_chunks)
+        if failed:
+            job.failures = (job.failures + failed)[-INGEST_MAX_FAILURES_RECORDED:]
+        job.heartbeat_at = func.now()
+        await session.commit()
+        return "cancelled" if job.cancel_requested else None
+
+async def _finish_job(job_id: str, worker_id: str, status: str, error_message: str | None = None,
+                      total_chunks: int | None = None) -> bool:
+    """Set the final (or queued again) status. False when another worker holds the job by now."""
+    async with get_session() as session:
+        values = {"status": status, "error_message": error_message, "heartbeat_at": func.now()}
+        if status != "queued":
+            values["finished_at"] = func.now()
+        if total_chunks is not None:
+            values["total_chunks"] = total_chunks
+        result = await session.execute(update(IngestionJob).where(_owned_by(job_id, worker_id)).values(**values))
+        await session.commit()
+        return result.rowcount > 0
+
+async def _upsert_batch(batch: list[dict]) -> list[dict]:
+    outcome = await upsert_docs(batch)
+    if outcome.get("status") != "success":
+        reason = outcome.get("message")
+        return [{"id": doc.get("id"), "action": "failed", "reason": reason} for doc in batch]
+    return outcome["results"]
+
+async def run_job(job: IngestionJob):
+    """
+    extract -> chunk -> embed -> upsert, skipping chunks a previous attempt already processed.
+    Upload jobs sync the file as a source: once all chunks are in, chunks of a previous
+    version of the file that are no longer present are deleted.
+    A heartbeat task runs alongside; if another worker took the job over (stale heartbeat),
+    this run stops without touching the job.
+    """
+    logger.info(f"Ingestion job {job.id} ({job.kind}) starting at chunk {job.processed_chunks}")
+    worker_id = job.worker_id
+    position = 0
+    batch = []
+    keep_ids = set()
+    estimate = {"total": job.total_chunks}
+    lost = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(job.id, worker_id, lost), name=f"ingestion-heartbeat-{job.id}")
+
+    def on_progress(tasks_done: int, tasks_total: int, chunks: int):
+        # Chunks per parse task so far, extrapolated to the remaining pages/segments
+        estimate["total"] = chunks if tasks_done == tasks_total else round(chunks * tasks_total / tasks_done)
+
+    async def stopped(outcome: str | None) -> bool:
+        if outcome == "cancelled":
+            await _finish_job(job.id, worker_id, "cancelled")
+            logger.info(f"Ingestion job {job.id} cancelled at chunk {position}")
+        elif outcome == "lost":
+            logger.warning(f"Ingestion job {job.id} was taken over by another worker, stopping at chunk {position}")
+        return outcome is not None
+
+    try:
+        async for doc in _job_documents(job, on_progress):
+            position += 1
+            keep_ids.add(doc.get("id"))
+            if position <= job.processed_chunks:
+                # Re-parsing up to the resume position: only the heartbeat can stop it
+                if await stopped("lost" if lost.is_set() else None):
+                    return
+                continue
+            batch.append(doc)
+            if len(batch) >= EMBEDDING_BATCH_SIZE:
+                if await stopped(await _record_batch(job.id, worker_id, await _upsert_batch(batch), len(batch), estimate["total"])):
+                    return
+                batch = []
+
+        if batch and await stopped(await _record_batch(job.id, worker_id, await _upsert_batch(batch), len(batch), estimate["total"])):
+            return
+        if await stopped("lost" if lost.is_set() else None):
+            return
+
+        if job.kind == "upload":
+            await prune_source(_job_source(job), keep_ids)
+
+        if not await _finish_job(job.id, worker_id, "completed", total_chunks=position):
+            await stopped("lost")
+            return
+        if position >= VECTOR_ANALYZE_MIN_CHANGES:
+            # Large ingest: refresh planner statistics and check the ANN index now rather than at the next interval
+            index_maintainer.wake()
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        logger.info(f"Ingestion job {job.id} completed ({position} chunks)")
+
+    except asyncio.CancelledError:
+        # Worker shutting down: hand the job back so another worker resumes it
+        await _finish_job(job.id, worker_id, "queued")
+        raise
+    except Exception as e:
+        logger.error(f"Ingestion job {job.id} failed: {e}")
+        await _finish_job(job.id, worker_id, "failed", error_message=str(e))
+    finally:
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+
+class IngestionWorkerPool:
+    """`size` asyncio tasks polling the ingestion_jobs table for work."""
+
+    def __init__(self, size: int, poll_interval: float):
+        self.size = size
+        self.poll_interval = poll_interval
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._run(f"{self.worker_prefix}:{i}"), name=f"ingestion-worker-{i}")
+            for i in range(self.size)
+        ]
+        logger.info(f"Started {self.size} ingestion workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, worker_id: str):
+        while True:
+            try:
+                job = await _claim_job(worker_id)
+            except Exception as e:
+                logger.error(f"Ingestion worker {worker_id} could not claim a job: {e}")
+                job = None
+
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await run_job(job)
+
+ingestion_workers = IngestionWorkerPool(INGEST_WORKERS, INGEST_POLL_INTERVAL)
@@ -0,0 +1,227 @@
+from sqlalchemy import text
+from loguru import logger
+from datetime import datetime, timedelta, timezone
+from app.core.database import maintenance_engine
+from app.services.embedding import prune_embedding_cache
+import asyncio
+import os
+
+LOG_PARTITION_INTERVAL = os.getenv("LOG_PARTITION_INTERVAL", "month").lower()
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", 2))
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", 0))
+LOG_PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("LOG_PARTITION_MAINTENANCE_INTERVAL", 3600))
+
+if LOG_PARTITION_INTERVAL not in ("day", "month"):
+    raise ValueError(f"LOG_PARTITION_INTERVAL must be 'day' or 'month', got '{LOG_PARTITION_INTERVAL}'")
+
+# Tables range-partitioned on "timestamp", with the columns copied over when migrating a plain table
+PARTITIONED_TABLES = {
+    "action_logs": ["id", "action_type", "resource_type", "resource_id", "request_data", "response_data",
+                    "status", "error_message", "latency_ms", "extra_info", "timestamp"],
+    "audit_logs": ["chat_id", "question", "response", "retrieved_docs", "latency_ms", "timestamp", "feedback"],
+}
+
+# Serializes partition DDL across workers and replicas
+_ADVISORY_LOCK_ID = 7_242_001
+
+def _period_start(dt: datetime) -> datetime:
+    dt = dt.astimezone(timezone.utc)
+    if LOG_PARTITION_INTERVAL == "day":
+        return datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+def _next_period(start: datetime) -> datetime:
+    if LOG_PARTITION_INTERVAL == "day":
+        return start + timedelta(days=1)
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+def _partition_name(table: str, start: datetime) -> str:
+    suffix = start.strftime("%Y%m%d") if LOG_PARTITION_INTERVAL == "day" else start.strftime("%Y%m")
+    return f"{table}_p{suffix}"
+
+def _partition_range(table: str, name: str) -> tuple[datetime, datetime] | None:
+    """
+    Period covered by a partition, read from its name. Decided by the suffix length,
+    not the current setting, so a change of LOG_PARTITION_INTERVAL keeps old partitions manageable.
+    """
+    suffix = name[len(f"{table}_p"):]
+    try:
+        if len(suffix) == 8:
+            start = datetime.strptime(suffix, "%Y%m%d").replace(tzinfo=timezone.utc)
+            return start, start + timedelta(days=1)
+        if len(suffix) == 6:
+            start = datetime.strptime(suffix, "%Y%m").replace(tzinfo=timezone.utc)
+            return start, datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=timezone.utc)
+    except ValueError:
+        pass
+    return None
+
+async def prepare_log_tables(conn) -> list[str]:
+    """
+    Rename plain (non-partitioned) log tables out of the way so create_all can build
+    the partitioned versions. Returns the renamed tables for copy_legacy_rows.
+    """
+    legacy = []
+    for table in PARTITIONED_TABLES:
+        result = await conn.execute(
+            text("SELECT relkind FROM pg_class WHERE relname = :table AND relnamespace = 'public'::regnamespace"),
+            {"table": table}
+        )
+        if result.scalar_one_or_none() != "r":
+            continue
+
+        legacy_table = f"{table}_legacy"
+        logger.warning(f"Converting {table} to a partitioned table, existing rows move via {legacy_table}")
+        await conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy_table}"))
+        await conn.execute(text(f"ALTER TABLE {legacy_table} RENAME CONSTRAINT {table}_pkey TO {legacy_table}_pkey"))
+        # Free index names for the partitioned table
+        indexes = await conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexname <> :pkey"),
+            {"table": legacy_table, "pkey": f"{legacy_table}_pkey"}
+        )
+        for index_name in indexes.scalars().all():
+            await conn.execute(text(f'DROP INDEX IF EXISTS "{index_name}"'))
+        legacy.append(legacy_table)
+    return legacy
+
+async def copy_legacy_rows(conn, legacy_tables: list[str]):
+    """Move rows from tables renamed by prepare_log_tables into their partitions, then drop them."""
+    for legacy_table in legacy_tables:
+        table = legacy_table[:-len("_legacy")]
+        oldest = (await conn.execute(text(f"SELECT min(timestamp) FROM {legacy_table}"))).scalar()
+        if oldest is not None:
+            await ensure_partitions(conn, table, since=oldest)
+
+        columns = PARTITIONED_TABLES[table]
+        select_cols = ", ".join("coalesce(timestamp, now())" if c == "timestamp" else c for c in columns)
+        result = await conn.execute(text(
+            f"INSERT INTO {table} ({', '.join(columns)}) SELECT {select_cols} FROM {legacy_table}"
+        ))
+        await conn.execute(text(f"DROP TABLE {legacy_table}"))
+        logger.info(f"Moved {result.rowcount} rows from {legacy_table} into partitioned {table}")
+
+async def _create_partition(conn, table: str, start: datetime, end: datetime):
+    """
+    Create the partition of one period. Rows of that period already in the default partition
+    (written after a clock jump or a downtime longer than LOG_PARTITIONS_AHEAD periods) would
+    make CREATE ... PARTITION OF fail, so they are moved into the new table before it is attached.
+    """
+    name = _partition_name(table, start)
+    if (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is not None:
+        return
+    bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    params = {"start": start, "end": end}
+    stray = await conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE timestamp >= :start AND timestamp < :end)"
+    ), params)
+    if not stray.scalar():
+        await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}"))
+        return
+
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = await conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE timestamp >= :start AND timestamp < :end RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), params)
+    await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+    logger.warning(f"Moved {moved.rowcount} rows of {table} from the default partition into {name}")
+
+async def ensure_partitions(conn, table: str, since: datetime | None = None, now: datetime | None = None):
+    """
+    Create the default partition and one partition per period from `since` (default: now) to
+    LOG_PARTITIONS_AHEAD periods ahead. A period that cannot be created is logged and skipped,
+    so it does not stop the others or the retention run.
+    """
+    now = now or datetime.now(timezone.utc)
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+    start = _period_start(since or now)
+    last = _period_start(now)
+    for _ in range(LOG_PARTITIONS_AHEAD):
+        last = _next_period(last)
+
+    while start <= last:
+        end = _next_period(start)
+        try:
+            async with conn.begin_nested():
+                await _create_partition(conn, table, start, end)
+        except Exception as e:
+            logger.error(f"Could not create partition {_partition_name(table, start)}: {e}")
+        start = end
+
+async def drop_expired_partitions(conn, table: str, now: datetime | None = None) -> list[str]:
+    """Drop whole partitions that end before the LOG_RETENTION_DAYS cutoff. No-op when retention is 0."""
+    if LOG_RETENTION_DAYS <= 0:
+        return []
+
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=LOG_RETENTION_DAYS)
+    result = await conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+    """), {"table": table})
+
+    dropped = []
+    for name in result.scalars().all():
+        bounds = _partition_range(table, name) if name.startswith(f"{table}_p") else None
+        if bounds and bounds[1] <= cutoff:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+
+    if dropped:
+        logger.info(f"Retention: dropped {len(dropped)} partitions of {table}: {dropped}")
+
+    # Rows outside every period partition live in the default one; expire them row by row
+    expired = await conn.execute(text(f"DELETE FROM {table}_default WHERE timestamp < :cutoff"), {"cutoff": cutoff})
+    if expired.rowcount:
+        logger.info(f"Retention: deleted {expired.rowcount} expired rows from {table}_default")
+    return dropped
+
+async def maintain_log_partitions(conn, now: datetime | None = None):
+    """Create upcoming partitions and apply retention for every partitioned log table."""
+    locked = await conn.execute(text(f"SELECT pg_try_advisory_xact_lock({_ADVISORY_LOCK_ID})"))
+    if not locked.scalar():
+        return
+    for table in PARTITIONED_TABLES:
+        await ensure_partitions(conn, table, now=now)
+        await drop_expired_partitions(conn, table, now=now)
+
+class PartitionMaintainer:
+    """
+    Background task running maintain_log_partitions every `interval` seconds, and the
+    retention of the embedding_cache table alongside it.
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="log-partition-maintenance")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with maintenance_engine.begin() as conn:
+                    await maintain_log_partitions(conn)
+            except Exception as e:
+                logger.error(f"Log partition maintenance failed: {e}")
+            try:
+                async with maintenance_engine.begin() as conn:
+                    await prune_embedding_cache(conn)
+            except Exception as e:
+                logger.error(f"Embedding cache pruning failed: {e}")
+
+partition_maintainer = PartitionMaintainer(LOG_PARTITION_MAINTENANCE_INTERVAL)
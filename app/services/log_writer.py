@@ -0,0 +1,161 @@
+from sqlalchemy import insert
+from loguru import logger
+from app.core.database import get_session
+from app.core.metrics import timed
+import asyncio
+import time
+import os
+
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", 10000))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", 500))
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "block").lower()
+
+QUEUE_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+if LOG_QUEUE_POLICY not in QUEUE_POLICIES:
+    raise ValueError(f"LOG_QUEUE_POLICY must be one of {QUEUE_POLICIES}, got '{LOG_QUEUE_POLICY}'")
+
+class LogWriter:
+    """
+    Write-behind queue for log rows. Callers enqueue (model, values) and return at once;
+    a background task groups rows per table and writes them with one multi-row INSERT
+    every `batch_size` rows or `flush_interval_ms`, whichever comes first.
+    When the queue is full `policy` decides: wait for room (block), drop the new
+    record (drop_newest) or drop the oldest queued record (drop_oldest).
+    """
+
+    def __init__(self, maxsize: int, batch_size: int, flush_interval_ms: int, policy: str):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.policy = policy
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = None
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name="log-writer")
+        logger.info(f"Log writer started (batch={self.batch_size}, interval={self.flush_interval}s, policy={self.policy})")
+
+    async def stop(self):
+        """Flush everything still queued, then stop the worker."""
+        if not self.running:
+            return
+        self._stopping = True
+        # Wake the worker if it is waiting on an empty queue
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        logger.info(f"Log writer stopped ({self.written} written, {self.dropped} dropped, {self.failed} failed)")
+
+    async def enqueue(self, model, values: dict):
+        # Without a running worker (scripts, tests) fall back to writing inline
+        if not self.running or self._stopping:
+            await self._flush([(model, values)])
+            return
+
+        if self.policy == "block":
+            await self._queue.put((model, values))
+            self.enqueued += 1
+            return
+
+        try:
+            self._queue.put_nowait((model, values))
+            self.enqueued += 1
+            return
+        except asyncio.QueueFull:
+            pass
+
+        # Either way one record is lost: the new one (drop_newest) or the oldest queued one
+        self.dropped += 1
+        if self.policy == "drop_oldest":
+            self._queue.get_nowait()
+            self._queue.put_nowait((model, values))
+            self.enqueued += 1
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "policy": self.policy,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_maxsize": self.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            batch = [] if item is None else [item]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                if self._stopping:
+                    # Shutting down: take what is queued without waiting for more
+                    if self._queue.empty():
+                        break
+                    item = self._queue.get_nowait()
+                else:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is not None:
+                    batch.append(item)
+
+            if batch:
+                await self._flush(batch)
+            if self._stopping and self._queue.empty():
+                return
+
+    async def _flush(self, batch: list[tuple]):
+        start = time.time()
+        by_model = {}
+        for model, values in batch:
+            by_model.setdefault(model, []).append(values)
+
+        with timed("log_writer.flush") as timer:
+            for model, rows in by_model.items():
+                try:
+                    # Never the request's session: an inline write must not commit the caller's work
+                    async with get_session(isolated=True) as session:
+                        await session.execute(insert(model), rows)
+                        await session.commit()
+                    self.written += len(rows)
+                except Exception as e:
+                    self.failed += len(rows)
+                    timer.failed = True
+                    logger.error(f"Failed to write {len(rows)} {model.__tablename__} rows: {e}")
+
+        self.flushes += 1
+        self.last_flush_ms = int((time.time() - start) * 1000)
+
+log_writer = LogWriter(
+    maxsize=LOG_QUEUE_MAXSIZE,
+    batch_size=LOG_BATCH_SIZE,
+    flush_interval_ms=LOG_FLUSH_INTERVAL_MS,
+    policy=LOG_QUEUE_POLICY,
+)
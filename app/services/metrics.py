@@ -0,0 +1,56 @@
+from app.core.metrics import CallbackMetric, render_metrics
+from app.core.database import engine, read_engine, read_routing_stats
+from app.services.embedding import embedding_cache_stats
+from app.services.answer_cache import answer_cache
+from app.services.log_writer import log_writer
+
+# Collected at scrape time from the counters the services already keep
+
+def _cache_requests():
+    caches = {"embedding_memory": embedding_cache_stats()["memory"], "answer": answer_cache.stats()}
+    persistent = embedding_cache_stats().get("persistent")
+    if persistent:
+        caches["embedding_persistent"] = persistent
+    return [
+        ({"cache": cache, "result": result}, stats[key])
+        for cache, stats in caches.items()
+        for result, key in (("hit", "hits"), ("miss", "misses"))
+    ]
+
+def _pool_connections():
+    engines = {"primary": engine}
+    if read_engine is not None:
+        engines["replica"] = read_engine
+    samples = []
+    for name, eng in engines.items():
+        pool = eng.pool
+        samples += [
+            ({"engine": name, "state": "size"}, pool.size()),
+            ({"engine": name, "state": "checked_out"}, pool.checkedout()),
+            ({"engine": name, "state": "checked_in"}, pool.checkedin()),
+            ({"engine": name, "state": "overflow"}, max(pool.overflow(), 0)),
+        ]
+    return samples
+
+def _read_routing():
+    stats = read_routing_stats()
+    return [({"result": result}, stats[result]) for result in ("replica", "primary", "fallbacks", "lag_guarded")]
+
+def _replica_lag():
+    lag = read_routing_stats()["replica_lag_ms"]
+    return [({}, lag / 1000)] if lag is not None else []
+
+def _log_writer_records():
+    stats = log_writer.stats()
+    return [({"result": result}, stats[result]) for result in ("written", "dropped", "failed")]
+
+CallbackMetric("cache_requests_total", "Cache lookups by cache and result.", "counter", _cache_requests)
+CallbackMetric("db_pool_connections", "Connections of the SQLAlchemy pool by state.", "gauge", _pool_connections)
+CallbackMetric("db_read_routing_total", "Read sessions by target, replica fallbacks and lag-guarded reads.", "counter", _read_routing)
+CallbackMetric("db_replica_lag_seconds", "Last measured replay lag of the read replica.", "gauge", _replica_lag)
+CallbackMetric("log_writer_queue_depth", "Log records waiting to be written.", "gauge",
+               lambda: [({}, log_writer.stats()["queue_depth"])])
+CallbackMetric("log_writer_records_total", "Log records by outcome.", "counter", _log_writer_records)
+
+def metrics_text() -> str:
+    return render_metrics()
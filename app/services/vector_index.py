@@ -0,0 +1,316 @@
+from sqlalchemy import text, select, update
+from sqlalchemy.dialects.postgresql import insert
+from loguru import logger
+from datetime import datetime, timezone
+from app.core.database import engine, maintenance_engine
+from app.models.vector_index_state import VectorIndexState
+from app.services.embedding import refresh_embedding_layout
+from app.services.vector_store import (
+    vector_index_sql, _nearest_sql, _candidate_count, _set_search_params,
+    VECTOR_INDEX_NAME, VECTOR_INDEX_TYPE, VECTOR_STORAGE_MODE, PGVECTOR_LISTS
+)
+import asyncio
+import math
+import time
+import os
+
+# An IVFFlat index trains its centroids on the rows present at build time: below this many rows the build is deferred
+VECTOR_INDEX_MIN_ROWS = int(os.getenv("VECTOR_INDEX_MIN_ROWS", 1000))
+# Rebuild an IVFFlat index once the table has grown by this fraction since the build
+VECTOR_INDEX_REBUILD_GROWTH = float(os.getenv("VECTOR_INDEX_REBUILD_GROWTH", 0.5))
+# Rebuild (any index type) once rows updated or deleted since the build exceed this fraction of the rows at build
+VECTOR_INDEX_REBUILD_DRIFT = float(os.getenv("VECTOR_INDEX_REBUILD_DRIFT", 0.3))
+VECTOR_INDEX_MAINTENANCE_INTERVAL = int(os.getenv("VECTOR_INDEX_MAINTENANCE_INTERVAL", 300))
+# maintenance_work_mem for index builds, e.g. 1GB; empty keeps the server setting
+VECTOR_INDEX_BUILD_MEMORY = os.getenv("VECTOR_INDEX_BUILD_MEMORY", "")
+# ANALYZE documents once this many rows (and VECTOR_ANALYZE_FRACTION of the table) changed since the last analyze
+VECTOR_ANALYZE_MIN_CHANGES = int(os.getenv("VECTOR_ANALYZE_MIN_CHANGES", 1000))
+VECTOR_ANALYZE_FRACTION = float(os.getenv("VECTOR_ANALYZE_FRACTION", 0.1))
+# Sampled queries for the recall estimate after each build; 0 disables it
+VECTOR_RECALL_SAMPLE = int(os.getenv("VECTOR_RECALL_SAMPLE", 20))
+VECTOR_RECALL_K = int(os.getenv("VECTOR_RECALL_K", 10))
+
+# Serializes index maintenance across workers and replicas
+_ADVISORY_LOCK_ID = 7_242_002
+
+def choose_lists(rows: int) -> int:
+    """pgvector's guidance: rows / 1000 lists up to 1M rows, sqrt(rows) above. PGVECTOR_LISTS overrides it."""
+    if PGVECTOR_LISTS:
+        return PGVECTOR_LISTS
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+async def table_stats(conn) -> dict:
+    """Live row count and modification counters of documents, from the statistics collector."""
+    result = await conn.execute(text("""
+        SELECT n_live_tup, n_tup_upd + n_tup_del AS changes, n_mod_since_analyze,
+               greatest(last_analyze, last_autoanalyze) AS analyzed_at
+        FROM pg_stat_user_tables WHERE relid = 'documents'::regclass
+    """))
+    row = result.one()
+    rows = row.n_live_tup
+    if not rows:
+        # Counters are flushed asynchronously and reset with the statistics; an exact count is cheap when they read 0
+        rows = (await conn.execute(text("SELECT count(*) FROM documents"))).scalar()
+    return {"rows": rows, "changes": row.changes, "mod_since_analyze": row.n_mod_since_analyze, "analyzed_at": row.analyzed_at}
+
+async def index_info(conn, name: str = VECTOR_INDEX_NAME) -> dict | None:
+    result = await conn.execute(text("""
+        SELECT i.indisvalid, pg_relation_size(c.oid) AS size_bytes, c.reloptions
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name
+    """), {"name": name})
+    row = result.one_or_none()
+    if row is None:
+        return None
+    options = dict(option.split("=", 1) for option in row.reloptions or [])
+    return {"valid": row.indisvalid, "size_bytes": row.size_bytes, "lists": int(options["lists"]) if "lists" in options else None}
+
+async def load_state(conn) -> VectorIndexState | None:
+    result = await conn.execute(select(VectorIndexState).where(VectorIndexState.index_name == VECTOR_INDEX_NAME))
+    return result.one_or_none()
+
+async def update_state(conn, **values):
+    await conn.execute(update(VectorIndexState).where(VectorIndexState.index_name == VECTOR_INDEX_NAME).values(**values))
+
+async def save_state(conn, **values):
+    stmt = insert(VectorIndexState).values(index_name=VECTOR_INDEX_NAME, index_type=VECTOR_INDEX_TYPE,
+                                           storage_mode=VECTOR_STORAGE_MODE, **values)
+    await conn.execute(stmt.on_conflict_do_update(
+        index_elements=["index_name"],
+        set_={key: stmt.excluded[key] for key in ("index_type", "storage_mode", *values)}
+    ))
+
+async def record_build(conn, lists: int | None, build_seconds: float | None = None):
+    """Remember what the current index was built from. Also called by the scripts that build it themselves."""
+    stats = await table_stats(conn)
+    await save_state(
+        conn, lists=lists if VECTOR_INDEX_TYPE == "ivfflat" else None, rows_at_build=stats["rows"],
+        changes_at_build=stats["changes"], built_at=datetime.now(timezone.utc), build_seconds=build_seconds,
+        recall=None, recall_checked_at=None,
+    )
+
+def rebuild_reason(stats: dict, info: dict | None, state) -> str | None:
+    """Why the index needs a (re)build now, None if it does not."""
+    if info is None or not info["valid"]:
+        if VECTOR_INDEX_TYPE == "ivfflat" and stats["rows"] < VECTOR_INDEX_MIN_ROWS:
+            return None
+        return "missing" if info is None else "invalid"
+    if state is None or state.index_type != VECTOR_INDEX_TYPE or state.storage_mode != VECTOR_STORAGE_MODE:
+        # Built before the index was tracked: IVFFlat centroids may come from a near-empty table
+        return "untracked" if VECTOR_INDEX_TYPE == "ivfflat" else None
+    if VECTOR_INDEX_TYPE == "ivfflat" and stats["rows"] > state.rows_at_build * (1 + VECTOR_INDEX_REBUILD_GROWTH):
+        return "grown"
+    if stats["changes"] - state.changes_at_build > max(state.rows_at_build, VECTOR_INDEX_MIN_ROWS) * VECTOR_INDEX_REBUILD_DRIFT:
+        return "drifted"
+    return None
+
+def _needs_analyze(stats: dict) -> bool:
+    return stats["mod_since_analyze"] >= max(VECTOR_ANALYZE_MIN_CHANGES, VECTOR_ANALYZE_FRACTION * stats["rows"])
+
+async def build_index(conn, rows: int) -> float:
+    """
+    Build the index under a temporary name with CREATE INDEX CONCURRENTLY, then swap it in
+    with a short transaction, so searches keep using the previous index meanwhile.
+    `conn` must be in AUTOCOMMIT mode. Returns the build time in seconds.
+    """
+    lists = choose_lists(rows)
+    temp_name = f"{VECTOR_INDEX_NAME}_rebuild"
+    # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+    await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {temp_name}"))
+    if VECTOR_INDEX_BUILD_MEMORY:
+        await conn.execute(text("SELECT set_config('maintenance_work_mem', :memory, false)"), {"memory": VECTOR_INDEX_BUILD_MEMORY})
+    start = time.time()
+    try:
+        await conn.execute(text(vector_index_sql(concurrently=True, name=temp_name, lists=lists)))
+    finally:
+        if VECTOR_INDEX_BUILD_MEMORY:
+            await conn.execute(text("RESET maintenance_work_mem"))
+    build_seconds = time.time() - start
+
+    async with engine.begin() as swap:
+        await swap.execute(text("SET LOCAL lock_timeout = '10s'"))
+        await swap.execute(text(f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME}"))
+        await swap.execute(text(f"ALTER INDEX {temp_name} RENAME TO {VECTOR_INDEX_NAME}"))
+
+    await record_build(conn, lists, build_seconds)
+    logger.info(f"Built {VECTOR_INDEX_NAME} ({VECTOR_INDEX_TYPE}, {VECTOR_STORAGE_MODE}, lists={lists}) over {rows} rows in {build_seconds:.1f}s")
+    return build_seconds
+
+async def estimate_recall(sample: int = VECTOR_RECALL_SAMPLE, k: int = VECTOR_RECALL_K) -> float | None:
+    """
+    Share of the exact top-k that the ANN search (same SQL and settings as search_similar)
+    returns, averaged over `sample` stored vectors used as queries. None on an empty table.
+    The sampled row itself is left out of both result sets: it is always found at distance 0.
+    """
+    async with maintenance_engine.connect() as conn:
+        rows = (await table_stats(conn))["rows"]
+        if not rows:
+            return None
+        # Page-level sampling avoids sorting the whole table by random()
+        percent = min(100.0, 100.0 * sample * 10 / rows)
+        result = await conn.execute(text(f"""
+            SELECT id, embedding::text AS embedding FROM documents TABLESAMPLE SYSTEM ({percent})
+            WHERE embedding IS NOT NULL LIMIT :sample
+        """), {"sample": sample})
+        queries = result.all()
+        await conn.rollback()
+
+        recalls = []
+        for self_id, query in queries:
+            async with conn.begin():
+                # One more than k so the top k are left once the query row is dropped
+                await _set_search_params(conn, _candidate_count(k + 1))
+                approximate = await conn.execute(_nearest_sql(), {
+                    "query_embedding_str": query, "min_sim_score": -2, "candidates": _candidate_count(k + 1), "k": k + 1,
+                })
+                # Rows come nearest first; keep k even when the ANN scan missed the query row
+                found = set([row.id for row in approximate if row.id != self_id][:k])
+            async with conn.begin():
+                await conn.execute(text("SET LOCAL enable_indexscan = off"))
+                exact = await conn.execute(text("""
+                    SELECT id FROM documents WHERE embedding IS NOT NULL AND id <> :self_id
+                    ORDER BY embedding <=> (:query_embedding_str)::vector LIMIT :k
+                """), {"query_embedding_str": query, "self_id": self_id, "k": k})
+                expected = {row.id for row in exact}
+            if expected:
+                recalls.append(len(found & expected) / len(expected))
+
+    return round(sum(recalls) / len(recalls), 4) if recalls else None
+
+async def update_recall() -> float | None:
+    recall = await estimate_recall()
+    async with engine.begin() as conn:
+        await update_state(conn, recall=recall, recall_checked_at=datetime.now(timezone.utc))
+    return recall
+
+async def maintain_vector_index(force_rebuild: bool = False) -> dict:
+    """
+    ANALYZE documents after large changes, and build or rebuild the ANN index when it is
+    missing, untracked, or stale (see rebuild_reason). Only one worker does it at a time.
+    """
+    # Rebuilds must use the dimension documents.embedding has now, not the configured one
+    await refresh_embedding_layout(force=True)
+    async with maintenance_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        locked = await conn.execute(text(f"SELECT pg_try_advisory_lock({_ADVISORY_LOCK_ID})"))
+        if not locked.scalar():
+            return {"action": "skipped", "reason": "maintenance running elsewhere"}
+        try:
+            outcome = {"action": "none", "analyzed": False}
+            stats = await table_stats(conn)
+            if _needs_analyze(stats):
+                await conn.execute(text("ANALYZE documents"))
+                outcome["analyzed"] = True
+                logger.info(f"Analyzed documents after {stats['mod_since_analyze']} changed rows")
+
+            info = await index_info(conn)
+            state = await load_state(conn)
+            reason = "forced" if force_rebuild and (info is not None or stats["rows"]) else rebuild_reason(stats, info, state)
+            if reason is None:
+                if info is None:
+                    outcome.update(action="deferred", reason=f"{stats['rows']} rows < VECTOR_INDEX_MIN_ROWS={VECTOR_INDEX_MIN_ROWS}")
+                elif state is None or state.index_type != VECTOR_INDEX_TYPE or state.storage_mode != VECTOR_STORAGE_MODE:
+                    await record_build(conn, info["lists"])
+                    outcome.update(action="adopted")
+                elif stats["changes"] < state.changes_at_build:
+                    # Statistics were reset: restart the drift count from here
+                    await update_state(conn, changes_at_build=stats["changes"])
+                return outcome
+
+            await build_index(conn, stats["rows"])
+            outcome.update(action="rebuilt", reason=reason)
+        finally:
+            await conn.execute(text(f"SELECT pg_advisory_unlock({_ADVISORY_LOCK_ID})"))
+
+    if VECTOR_RECALL_SAMPLE:
+        outcome["recall"] = await update_recall()
+    return outcome
+
+async def vector_index_health() -> dict:
+    async with engine.connect() as conn:
+        stats = await table_stats(conn)
+        info = await index_info(conn)
+        state = await load_state(conn)
+
+    health = {
+        "index_name": VECTOR_INDEX_NAME,
+        "index_type": VECTOR_INDEX_TYPE,
+        "storage_mode": VECTOR_STORAGE_MODE,
+        "exists": info is not None,
+        "valid": info["valid"] if info else None,
+        "size_bytes": info["size_bytes"] if info else None,
+        "lists": info["lists"] if info else None,
+        "rows": stats["rows"],
+        "rows_changed_since_analyze": stats["mod_since_analyze"],
+        "analyzed_at": stats["analyzed_at"],
+        "pending_rebuild": rebuild_reason(stats, info, state),
+        "maintainer": index_maintainer.stats(),
+    }
+    if state is not None:
+        drift = (stats["changes"] - state.changes_at_build) / max(state.rows_at_build, 1)
+        health.update({
+            "rows_at_build": state.rows_at_build,
+            "growth_since_build": round(stats["rows"] / state.rows_at_build - 1, 4) if state.rows_at_build else None,
+            "drift_since_build": round(drift, 4),
+            "built_at": state.built_at,
+            "build_seconds": state.build_seconds,
+            "recall": state.recall,
+            "recall_k": VECTOR_RECALL_K,
+            "recall_checked_at": state.recall_checked_at,
+        })
+    return health
+
+class IndexMaintainer:
+    """
+    Background task running maintain_vector_index at startup, every `interval` seconds,
+    and right away when woken (after a large ingest or an admin request).
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+        self._force_rebuild = False
+        self.last_run_at: datetime | None = None
+        self.last_outcome: dict | None = None
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="vector-index-maintenance")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self, force_rebuild: bool = False):
+        self._force_rebuild = self._force_rebuild or force_rebuild
+        self._wake.set()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval": self.interval,
+            "last_run_at": self.last_run_at,
+            "last_outcome": self.last_outcome,
+        }
+
+    async def _run(self):
+        while True:
+            force_rebuild, self._force_rebuild = self._force_rebuild, False
+            self._wake.clear()
+            try:
+                self.last_outcome = await maintain_vector_index(force_rebuild)
+            except Exception as e:
+                self.last_outcome = {"action": "failed", "error": str(e)}
+                logger.error(f"Vector index maintenance failed: {e}")
+            self.last_run_at = datetime.now(timezone.utc)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+index_maintainer = IndexMaintainer(VECTOR_INDEX_MAINTENANCE_INTERVAL)
@@ -1,87 +1,298 @@
-from sqlalchemy import delete, select, text
+from sqlalchemy import delete, select, text, literal, literal_column, func, tuple_
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import SQLAlchemyError
-from app.core.database import get_session
-from app.models.document import Document
-from app.services.embedding import get_embedding
+from app.core.database import get_session, get_read_session
+from app.core.pagination import encode_cursor, decode_cursor
+from app.core.metrics import timed
+from fastapi import HTTPException
+from pgvector.sqlalchemy import Vector
+from app.models.document import Document, TEXT_SEARCH_CONFIG
+from app.services.embedding import (
+    get_embedding, get_embeddings, get_query_embeddings, EMBEDDING_BATCH_SIZE,
+    embedding_dims, fit_dimension, refresh_embedding_layout, SHADOW_EMBEDDING_COLUMN,
+)
 from app.services.action_logs import log_action
+from app.services.answer_cache import answer_cache
+import asyncio
+import hashlib
 import time
 import json
 import uuid
+import os
 from loguru import logger
-
+from typing import AsyncIterator
+
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "ivfflat").lower()
+# 0: chosen from the row count by app.services.vector_index
+PGVECTOR_LISTS = int(os.getenv("PGVECTOR_LISTS", 0))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", 10))
+HNSW_M = int(os.getenv("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 64))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 40))
+# Vector the ANN index is built on: full (vector), halfvec (16-bit floats, half the size) or
+# binary (1 bit per dimension); compact modes re-rank VECTOR_RERANK_FACTOR x k candidates exactly
+VECTOR_STORAGE_MODE = os.getenv("VECTOR_STORAGE_MODE", "full").lower()
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", 4))
+# pgvector >= 0.8: keep scanning the index until enough rows pass the metadata filters
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "relaxed_order").lower()
+
+# Retrieval defaults, each can be overridden per chat request
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+HYBRID_VECTOR_K = int(os.getenv("HYBRID_VECTOR_K", 20))
+HYBRID_LEXICAL_K = int(os.getenv("HYBRID_LEXICAL_K", 20))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", 1.0))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", 1.0))
+RRF_K = int(os.getenv("RRF_K", 60))
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+# /knowledge/search batches: max queries per request and lookups running at once (each holds a pooled connection)
+SEARCH_MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", 100))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 5))
+# Upper bound of k per /knowledge/search query
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", 100))
+
+# /knowledge listing: default page size in keyset mode, rows per server-side cursor fetch when streaming
+LIST_DOCS_PAGE_SIZE = int(os.getenv("LIST_DOCS_PAGE_SIZE", 100))
+LIST_DOCS_FETCH_SIZE = int(os.getenv("LIST_DOCS_FETCH_SIZE", 1000))
+
+if VECTOR_INDEX_TYPE not in ("ivfflat", "hnsw"):
+    raise ValueError(f"VECTOR_INDEX_TYPE must be 'ivfflat' or 'hnsw', got '{VECTOR_INDEX_TYPE}'")
+if VECTOR_STORAGE_MODE not in ("full", "halfvec", "binary"):
+    raise ValueError(f"VECTOR_STORAGE_MODE must be 'full', 'halfvec' or 'binary', got '{VECTOR_STORAGE_MODE}'")
+if VECTOR_ITERATIVE_SCAN not in ("off", "relaxed_order", "strict_order"):
+    raise ValueError(f"VECTOR_ITERATIVE_SCAN must be 'off', 'relaxed_order' or 'strict_order', got '{VECTOR_ITERATIVE_SCAN}'")
+if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+    raise ValueError(f"RETRIEVAL_MODE must be one of {RETRIEVAL_MODES}, got '{RETRIEVAL_MODE}'")
+
+def vector_index_name(index_type: str = VECTOR_INDEX_TYPE, storage_mode: str = VECTOR_STORAGE_MODE) -> str:
+    if storage_mode == "full":
+        return "documents_embedding_idx" if index_type == "ivfflat" else "documents_embedding_hnsw_idx"
+    return f"documents_embedding_{'halfvec' if storage_mode == 'halfvec' else 'bit'}_{index_type}_idx"
+
+VECTOR_INDEX_NAME = vector_index_name()
+
+def _index_target(column: str, dim: int) -> tuple[str, str]:
+    """
+    ANN index expression and opclass for the configured storage mode. Compact modes index an
+    expression of the full vector, so existing rows need no migration and the exact vector
+    stays available for re-ranking.
+    """
+    if VECTOR_STORAGE_MODE == "halfvec":
+        return f"({column}::halfvec({dim}))", "halfvec_cosine_ops"
+    if VECTOR_STORAGE_MODE == "binary":
+        return f"(binary_quantize({column})::bit({dim}))", "bit_hamming_ops"
+    return column, "vector_cosine_ops"
+
+def vector_index_sql(concurrently: bool = False, column: str = "embedding", dim: int | None = None,
+                     name: str = VECTOR_INDEX_NAME, lists: int = PGVECTOR_LISTS or 100) -> str:
+    """
+    CREATE INDEX statement for the configured VECTOR_INDEX_TYPE and VECTOR_STORAGE_MODE.
+    `column`, `dim` and `name` are only overridden for shadow indexes (rebuilds, reindex script);
+    `dim` defaults to the documents.embedding dimension last read from the database.
+    `lists` comes from app.services.vector_index.choose_lists.
+    """
+    expression, opclass = _index_target(column, dim or embedding_dims()[0])
+    if VECTOR_INDEX_TYPE == "hnsw":
+        using = f"hnsw ({expression} {opclass}) WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+    else:
+        using = f"ivfflat ({expression} {opclass}) WITH (lists = {lists})"
+    return f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} ON documents USING {using}"
+
+def _candidate_order() -> str:
+    """ORDER BY expression served by the ANN index (must match the index expression)."""
+    dim = embedding_dims()[0]
+    if VECTOR_STORAGE_MODE == "halfvec":
+        return f"embedding::halfvec({dim}) <=> (:query_embedding_str)::halfvec({dim})"
+    if VECTOR_STORAGE_MODE == "binary":
+        return f"binary_quantize(embedding)::bit({dim}) <~> binary_quantize((:query_embedding_str)::vector)"
+    return "embedding <=> (:query_embedding_str)::vector"
+
+async def ensure_document_columns(conn):
+    """Add columns introduced after the documents table was first created, and backfill them."""
+    await conn.execute(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"))
+    await conn.execute(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS source VARCHAR"))
+    # Generated column: Postgres keeps it in sync on every insert/update, and fills it for existing rows
+    await conn.execute(text(f"""
+        ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', content)) STORED
+    """))
+    await conn.execute(text("""
+        UPDATE documents SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+        WHERE content_hash IS NULL
+    """))
+    # Chunks uploaded before source tracking belong to the file they came from
+    await conn.execute(text("""
+        UPDATE documents SET source = extra_info->>'filename'
+        WHERE source IS NULL AND extra_info ? 'filename'
+    """))
+
+async def _set_search_params(session, k: int, filtered: bool = False):
+    # SET LOCAL only lasts for the current transaction, so it never leaks into pooled connections
+    if VECTOR_INDEX_TYPE == "hnsw":
+        await session.execute(text(f"SET LOCAL hnsw.ef_search = {max(HNSW_EF_SEARCH, int(k))}"))
+    else:
+        await session.execute(text(f"SET LOCAL ivfflat.probes = {IVFFLAT_PROBES}"))
+    # Without it a selective filter drops most of the ef_search/probes candidates and returns fewer than k rows
+    if filtered and VECTOR_ITERATIVE_SCAN != "off":
+        await session.execute(text(f"SET LOCAL {VECTOR_INDEX_TYPE}.iterative_scan = {VECTOR_ITERATIVE_SCAN}"))
+
+def validate_filters(filters: dict | None) -> dict:
+    """Filters are {key: value} or {key: [values]} with string/number/bool values. Raises ValueError otherwise."""
+    if not filters:
+        return {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object of {key: value or [values]}")
+    for key, value in filters.items():
+        values = value if isinstance(value, list) else [value]
+        if not values or not all(isinstance(v, (str, int, float, bool)) for v in values):
+            raise ValueError(f"Filter '{key}' must be a string, number, boolean or a non-empty list of them")
+    return filters
+
+def _metadata_clause(filters: dict | None) -> tuple[str, dict]:
+    """
+    SQL condition and bind params for metadata filters, ANDed across keys.
+    A list value matches any of its values. Values are matched with `extra_info @>` (GIN
+    jsonb_path_ops index) against the stored value or an array containing it, so
+    {"tags": "a"} matches {"tags": "a"} and {"tags": ["a", "b"]}.
+    `filename` uses the expression index and `source` the source column.
+    """
+    conditions, params = [], {}
+    for i, (key, value) in enumerate(validate_filters(filters).items()):
+        values = value if isinstance(value, list) else [value]
+        if key in ("filename", "source"):
+            column = "extra_info ->> 'filename'" if key == "filename" else "source"
+            names = [f"filter_{i}_{j}" for j in range(len(values))]
+            conditions.append(f"{column} IN ({', '.join(':' + n for n in names)})")
+            params.update({n: str(v) for n, v in zip(names, values)})
+            continue
+
+        alternatives = []
+        for j, v in enumerate(values):
+            params[f"filter_{i}_{j}"] = json.dumps({key: v})
+            params[f"filter_{i}_{j}_in"] = json.dumps({key: [v]})
+            alternatives.append(f"extra_info @> CAST(:filter_{i}_{j} AS jsonb)")
+            alternatives.append(f"extra_info @> CAST(:filter_{i}_{j}_in AS jsonb)")
+        conditions.append(f"({' OR '.join(alternatives)})")
+    return " AND ".join(conditions), params
+
+@timed("vector_store.upsert")
 async def upsert_docs(docs: list[dict]):
     async with get_session() as session:
-        results = []
         try:
-            for doc in docs:
-                doc["id"] = doc.get("id", str(uuid.uuid4()))
-                start = time.time()
-                
-                if "text" not in doc:
-                    results.append({"id": doc["id"], "action": "failed", "reason": "Missing 'text'"})
+            results = await _upsert_in_session(session, docs)
+            await session.commit()
+            answer_cache.invalidate_docs(r["id"] for r in results if r["action"] in ("inserted", "updated"))
+            return {"status": "success", "results": results}
 
-                    await log_action(
-                        action_type="upsert",
-                        resource_type="document",
-                        resource_id=doc.get("id"),
-                        request_data=doc,
-                        status="failed",
-                        error_message=reason
-                    )
-                    continue
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"Database error during bulk upsert: {e}")
+            return {"status": "error", "message": f"Database error: {str(e)}"}
 
-                exists = await session.execute(select(Document.id).where(Document.id == doc["id"]))
-                exists = exists.scalar_one_or_none()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Unexpected error during bulk upsert: {e}")
+            return {"status": "error", "message": f"Unexpected error: {str(e)}"}
 
-                try:
-                    vec = await get_embedding(doc["text"])
-                except Exception as e:
-                    reason = f"Embedding error: {str(e)}"
-                    logger.error(reason)
-                    results.append({"id": doc["id"], "action": "failed", "reason": reason})
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-                    await log_action(
-                        action_type="upsert",
-                        resource_type="document",
-                        resource_id=doc["id"],
-                        request_data={"text": doc["text"]},
-                        status="failed",
-                        error_message=reason
-                    )
-                    continue
-
-                try:
-                    stmt = insert(Document).values(
-                        id=doc["id"],
-                        content=doc["text"],
-                        embedding=vec,
-                        extra_info=doc.get("extra_info", {}),
-                    ).on_conflict_do_update(
-                        index_elements=["id"],
-                        set_={"content": doc["text"], "embedding": vec, "extra_info": doc.get("extra_info", {})}
-                    )
-                    await session.execute(stmt)
+async def _upsert_in_session(session, docs: list[dict]) -> list[dict]:
+    """
+    Upsert `docs` in the caller's transaction (no commit). Per document result action is
+    inserted, updated, unchanged (same text and extra_info, row left as is) or failed.
+    Only texts whose content hash has no stored vector yet are sent to the embedding model.
+    """
+    results = []
+    pending = {}
+    for doc in docs:
+        doc["id"] = doc.get("id", str(uuid.uuid4()))
 
-                    action = "updated" if exists else "inserted"
-                    latency = int((time.time() - start) * 1000)
+        if "text" not in doc:
+            reason = "Missing 'text'"
+            results.append({"id": doc["id"], "action": "failed", "reason": reason})
 
-                    results.append({"id": doc["id"], "action": action})
+            await log_action(
+                action_type="upsert",
+                resource_type="document",
+                resource_id=doc.get("id"),
+                request_data=doc,
+                status="failed",
+                error_message=reason
+            )
+            continue
+
+        # Same id twice in one request: the later entry wins, one row per id per INSERT
+        pending.pop(doc["id"], None)
+        pending[doc["id"]] = doc
 
+    hashes = {doc_id: content_hash(doc["text"]) for doc_id, doc in pending.items()}
+    existing = await _existing_rows(session, list(pending))
+
+    to_write = []
+    for doc_id, doc in pending.items():
+        stored = existing.get(doc_id)
+        if stored and stored[0] == hashes[doc_id] and stored[1] == doc.get("extra_info", {}):
+            results.append({"id": doc_id, "action": "unchanged"})
+            await log_action(
+                action_type="unchanged",
+                resource_type="document",
+                resource_id=doc_id,
+                status="success"
+            )
+            continue
+        to_write.append(doc)
+
+    # Reuse stored vectors of identical content (same doc with new metadata, or another doc).
+    # Not during a reindex: stored vectors are too short for the shadow column.
+    await refresh_embedding_layout()
+    reuse = embedding_dims()[1] is None
+    vectors = await _vectors_by_hash(session, {hashes[doc["id"]] for doc in to_write}) if reuse else {}
+    batches = [to_write[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(to_write), EMBEDDING_BATCH_SIZE)]
+
+    def missing_texts(batch):
+        texts = {}
+        for doc in batch:
+            h = hashes[doc["id"]]
+            if h not in vectors:
+                texts.setdefault(h, doc["text"])
+        return texts
+
+    # Embed all batches concurrently, write each one as soon as its vectors are ready
+    start = time.time()
+    batch_texts = [missing_texts(batch) for batch in batches]
+    tasks = [
+        asyncio.create_task(get_embeddings(list(texts.values()))) if texts else None
+        for texts in batch_texts
+    ]
+    try:
+        for batch, texts, task in zip(batches, batch_texts, tasks):
+            try:
+                if task is not None:
+                    vectors.update(zip(texts.keys(), await task))
+            except Exception as e:
+                reason = f"Embedding error: {str(e)}"
+                logger.error(reason)
+                for doc in batch:
+                    results.append({"id": doc["id"], "action": "failed", "reason": reason})
                     await log_action(
-                        action_type=action,
+                        action_type="upsert",
                         resource_type="document",
                         resource_id=doc["id"],
                         request_data={"text": doc["text"]},
-                        latency_ms=latency,
-                        status="success"
+                        status="failed",
+                        error_message=reason
                     )
-
-                except SQLAlchemyError as e:
-                    reason = f"Database error: {str(e)}"
-                    logger.error(reason)
+                continue
+
+            try:
+                inserted = await _write_batch(session, batch, [vectors[hashes[doc["id"]]] for doc in batch], hashes)
+            except (SQLAlchemyError, ValueError) as e:
+                reason = f"Database error: {str(e)}"
+                logger.error(reason)
+                for doc in batch:
                     results.append({"id": doc["id"], "action": "failed", "reason": reason})
-
                     await log_action(
                         action_type="upsert",
                         resource_type="document",
@@ -90,21 +301,244 @@ async def upsert_docs(docs: list[dict]):
                         status="failed",
                         error_message=reason
                     )
-                    continue
+                continue
 
+            latency = int((time.time() - start) * 1000)
+            for doc in batch:
+                action = "inserted" if inserted.get(doc["id"]) else "updated"
+                results.append({"id": doc["id"], "action": action})
+                await log_action(
+                    action_type=action,
+                    resource_type="document",
+                    resource_id=doc["id"],
+                    request_data={"text": doc["text"]},
+                    latency_ms=latency,
+                    status="success"
+                )
+    finally:
+        live = [task for task in tasks if task is not None]
+        for task in live:
+            task.cancel()
+        await asyncio.gather(*live, return_exceptions=True)
+
+    return results
+
+# Keeps IN (...) lists well under the driver's bind parameter limit
+_LOOKUP_CHUNK = 5000
+
+async def _existing_rows(session, ids: list[str]) -> dict:
+    """{id: (content_hash, extra_info)} for the ids that already exist, in one query per chunk."""
+    existing = {}
+    for i in range(0, len(ids), _LOOKUP_CHUNK):
+        result = await session.execute(
+            select(Document.id, Document.content_hash, Document.extra_info)
+            .where(Document.id.in_(ids[i:i + _LOOKUP_CHUNK]))
+        )
+        existing.update({row.id: (row.content_hash, row.extra_info) for row in result})
+    return existing
+
+async def _vectors_by_hash(session, hashes: set[str]) -> dict:
+    """{content_hash: embedding} for hashes already stored on any document."""
+    hashes = list(hashes)
+    vectors = {}
+    for i in range(0, len(hashes), _LOOKUP_CHUNK):
+        result = await session.execute(
+            select(Document.content_hash, Document.embedding)
+            .where(Document.content_hash.in_(hashes[i:i + _LOOKUP_CHUNK]))
+            .distinct(Document.content_hash)
+        )
+        vectors.update({row.content_hash: row.embedding for row in result if row.embedding is not None})
+    return vectors
+
+async def _layout_changed() -> bool:
+    """Re-read the vector column dimensions after a failed statement; True if they changed (reindex swap)."""
+    before = embedding_dims()
+    await refresh_embedding_layout(force=True)
+    return embedding_dims() != before
+
+def _upsert_stmt(batch: list[dict], vectors: list, hashes: dict, dim: int):
+    # Vector() without a dimension: the column may no longer have the dimension the model was loaded with
+    stmt = insert(Document).values([
+        {
+            "id": doc["id"],
+            "content": doc["text"],
+            "content_hash": hashes[doc["id"]],
+            "embedding": literal(fit_dimension(vec, dim), Vector()),
+            "extra_info": doc.get("extra_info", {}),
+            "source": doc.get("source"),
+        }
+        for doc, vec in zip(batch, vectors)
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["id"],
+        set_={
+            "content": stmt.excluded.content,
+            "content_hash": stmt.excluded.content_hash,
+            "embedding": stmt.excluded.embedding,
+            "extra_info": stmt.excluded.extra_info,
+            # A plain /knowledge/update of a sourced chunk keeps its source
+            "source": func.coalesce(stmt.excluded.source, Document.source),
+        }
+    ).returning(Document.id, literal_column("(xmax = 0)").label("inserted"))
+    return stmt
+
+async def _write_batch(session, batch: list[dict], vectors: list, hashes: dict) -> dict:
+    """
+    Write one batch with a single multi-row INSERT ... ON CONFLICT.
+    Returns {id: True if inserted, False if updated}. A failing batch is rolled back to its savepoint only.
+    While app/scripts/reindex_embeddings.py runs, the vectors also go to the shadow column, so rows
+    written during the backfill need no catch-up. A batch that fails because the swap changed the
+    columns meanwhile is retried once with the new layout.
+    """
+    for attempt in (1, 2):
+        dim, shadow_dim = embedding_dims()
+        try:
+            async with session.begin_nested():
+                result = await session.execute(_upsert_stmt(batch, vectors, hashes, dim))
+                inserted = {row.id: row.inserted for row in result}
+                if shadow_dim:
+                    await session.execute(
+                        text(f"UPDATE documents SET {SHADOW_EMBEDDING_COLUMN} = (:embedding)::vector WHERE id = :id"),
+                        [
+                            {"id": doc["id"], "embedding": json.dumps(fit_dimension(vec, shadow_dim))}
+                            for doc, vec in zip(batch, vectors)
+                        ]
+                    )
+                return inserted
+        except SQLAlchemyError:
+            if attempt == 2 or not await _layout_changed():
+                raise
+
+
+# Namespace for deterministic chunk ids of source-aware ingestion
+SOURCE_CHUNK_NAMESPACE = uuid.UUID("8f1d6c1e-5b7a-4a57-9a6c-2f0e8d3b9c41")
+
+def source_chunk_id(source: str, position: int, chunk_hash: str) -> str:
+    """
+    Deterministic id of a chunk: source + content hash + position among the chunks of that
+    source with identical content. Inserting a paragraph therefore keeps the ids of every
+    other chunk, so a re-upload only touches what changed.
+    """
+    return str(uuid.uuid5(SOURCE_CHUNK_NAMESPACE, f"{source}\x00{position}\x00{chunk_hash}"))
+
+async def source_documents(source: str, docs: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """Tag a stream of chunks with `source` and their deterministic ids."""
+    occurrences = {}
+    async for doc in docs:
+        chunk_hash = content_hash(doc["text"])
+        position = occurrences.get(chunk_hash, 0)
+        occurrences[chunk_hash] = position + 1
+        yield {**doc, "id": source_chunk_id(source, position, chunk_hash), "source": source}
+
+async def _prune_source(session, source: str, keep_ids: set[str]) -> list[str]:
+    """Delete chunks of `source` not in `keep_ids`, in the caller's transaction."""
+    result = await session.execute(select(Document.id).where(Document.source == source))
+    stale = [doc_id for doc_id in result.scalars().all() if doc_id not in keep_ids]
+    for i in range(0, len(stale), _LOOKUP_CHUNK):
+        await session.execute(delete(Document).where(Document.id.in_(stale[i:i + _LOOKUP_CHUNK])))
+    return stale
+
+async def sync_source(source: str, docs: AsyncIterator[dict], batch_size: int = EMBEDDING_BATCH_SIZE):
+    """
+    Make the stored chunk set of `source` equal to `docs` in one transaction:
+    new chunks are inserted, changed ones updated, unchanged ones skipped and chunks
+    no longer present deleted. Any failed chunk rolls the whole sync back.
+    """
+    async with get_session() as session:
+        start = time.time()
+        results, keep_ids = [], set()
+        try:
+            batch = []
+            async for doc in source_documents(source, docs):
+                keep_ids.add(doc["id"])
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    results.extend(await _upsert_in_session(session, batch))
+                    batch = []
+            if batch:
+                results.extend(await _upsert_in_session(session, batch))
+
+            failed = [r for r in results if r["action"] == "failed"]
+            if failed:
+                await session.rollback()
+                reason = f"{len(failed)} chunks failed, nothing was changed"
+                await log_action(
+                    action_type="upsert",
+                    resource_type="source",
+                    resource_id=source,
+                    response_data={"failed": failed[:20]},
+                    status="failed",
+                    error_message=reason
+                )
+                return {"status": "error", "source": source, "message": reason, "results": failed}
+
+            deleted = await _prune_source(session, source, keep_ids)
             await session.commit()
-            return {"status": "success", "results": results}
+            answer_cache.invalidate_docs([r["id"] for r in results if r["action"] in ("inserted", "updated")] + deleted)
 
-        except SQLAlchemyError as e:
-            await session.rollback()
-            logger.error(f"Database error during bulk upsert: {e}")
-            return {"status": "error", "message": f"Database error: {str(e)}"}
+            summary = {action: sum(1 for r in results if r["action"] == action) for action in ("inserted", "updated", "unchanged")}
+            summary["deleted"] = len(deleted)
+            await log_action(
+                action_type="upsert",
+                resource_type="source",
+                resource_id=source,
+                response_data=summary,
+                latency_ms=int((time.time() - start) * 1000),
+                status="success"
+            )
+            return {"status": "success", "source": source, **summary, "results": results}
 
         except Exception as e:
             await session.rollback()
-            logger.error(f"Unexpected error during bulk upsert: {e}")
-            return {"status": "error", "message": f"Unexpected error: {str(e)}"}
+            logger.error(f"Error while syncing source {source}: {e}")
+            await log_action(
+                action_type="upsert",
+                resource_type="source",
+                resource_id=source,
+                status="failed",
+                error_message=str(e)
+            )
+            return {"status": "error", "source": source, "message": str(e)}
+
+async def prune_source(source: str, keep_ids: set[str]) -> list[str]:
+    """Delete chunks of `source` not in `keep_ids` and commit. Used by resumable ingestion jobs."""
+    async with get_session() as session:
+        deleted = await _prune_source(session, source, keep_ids)
+        await session.commit()
+    answer_cache.invalidate_docs(deleted)
+    return deleted
 
+async def delete_source(source: str):
+    """Remove every chunk of a source with one indexed DELETE."""
+    async with get_session() as session:
+        start = time.time()
+        try:
+            result = await session.execute(delete(Document).where(Document.source == source).returning(Document.id))
+            deleted = result.scalars().all()
+            await session.commit()
+            answer_cache.invalidate_docs(deleted)
+
+            await log_action(
+                action_type="delete",
+                resource_type="source",
+                resource_id=source,
+                response_data={"deleted": len(deleted)},
+                latency_ms=int((time.time() - start) * 1000),
+                status="success"
+            )
+            return {"success": True, "source": source, "deleted": len(deleted)}
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"Database error while deleting source {source}: {e}")
+            await log_action(
+                action_type="delete",
+                resource_type="source",
+                resource_id=source,
+                status="failed",
+                error_message=f"Database error: {str(e)}"
+            )
+            return {"success": False, "message": f"Database error: {str(e)}"}
 
 async def delete_doc(doc_id: str):
     async with get_session() as session:
@@ -125,6 +559,7 @@ async def delete_doc(doc_id: str):
 
             await session.execute(delete(Document).where(Document.id == doc_id))
             await session.commit()
+            answer_cache.invalidate_docs([doc_id])
 
             latency = int((time.time() - start) * 1000)
 
@@ -163,32 +598,58 @@ async def delete_doc(doc_id: str):
             )
             return {"success": False, "message": f"Unexpected error: {str(e)}"}
 
-async def list_docs():
-    async with get_session() as session:
+def _listing_stmt(include_content: bool):
+    """Listing columns only: never the embedding or tsvector, and size computed by Postgres."""
+    columns = [Document.id, Document.created_at, func.length(Document.content).label("size")]
+    if include_content:
+        columns.append(Document.content)
+    return select(*columns).order_by(Document.created_at.desc(), Document.id.desc())
+
+def _listing_row(row, include_content: bool) -> dict:
+    item = {"id": row.id, "created_at": row.created_at}
+    if include_content:
+        item["content"] = row.content
+    item["size"] = row.size
+    return item
+
+async def list_docs(limit: int | None = None, cursor: str | None = None, keyset: bool = False,
+                    include_content: bool = True, replica: bool | None = None):
+    """
+    Newest first. Without `limit`/`cursor`/`keyset` every document is returned as one list,
+    as before. Keyset mode returns {"items": [...], "next_cursor": ...} pages of `limit`.
+    For full exports use stream_docs, which keeps memory flat.
+    """
+    async with get_read_session(("documents",), replica=replica) as session:
         try:
-            result = await session.execute(select(Document))
-            docs = result.scalars().all()
-
-            response_data = [
-                {
-                    "id": d.id,
-                    "created_at": d.created_at,
-                    "content": d.content,
-                    "size": len(d.content)
-                }
-                for d in docs
-            ]
+            stmt = _listing_stmt(include_content)
+            paged = bool(cursor or keyset)
+            if cursor:
+                last_ts, last_id = decode_cursor(cursor)
+                stmt = stmt.where(tuple_(Document.created_at, Document.id) < tuple_(last_ts, last_id))
+            if limit or paged:
+                # One extra row tells whether another page exists
+                stmt = stmt.limit((limit or LIST_DOCS_PAGE_SIZE) + (1 if paged else 0))
+
+            result = await session.execute(stmt)
+            rows = result.all()
+            page = rows[:limit or LIST_DOCS_PAGE_SIZE] if paged else rows
+            response_data = [_listing_row(row, include_content) for row in page]
 
             await log_action(
                 action_type="list",
                 resource_type="document",
-                request_data={},  # No input for list
+                request_data={"limit": limit, "keyset": paged},
                 response_data={"count": len(response_data)},
                 status="success"
             )
 
-            return response_data
+            if not paged:
+                return response_data
+            next_cursor = encode_cursor(page[-1].created_at, page[-1].id) if len(rows) > len(page) else None
+            return {"items": response_data, "next_cursor": next_cursor}
 
+        except HTTPException:
+            raise
         except Exception as e:
             await log_action(
                 action_type="list",
@@ -199,8 +660,33 @@ async def list_docs():
 
             return {"status": "error", "message": str(e)}
 
-async def search_knowledge_by_id(knowledge_id: str):
-    async with get_session() as session:
+async def stream_docs(include_content: bool = True, replica: bool | None = None) -> AsyncIterator[str]:
+    """
+    Every document as NDJSON lines, read through a server-side cursor LIST_DOCS_FETCH_SIZE
+    rows at a time, so memory stays flat whatever the table size.
+    """
+    count = 0
+    start = time.time()
+    async with get_read_session(("documents",), replica=replica) as session:
+        result = await session.stream(
+            _listing_stmt(include_content).execution_options(yield_per=LIST_DOCS_FETCH_SIZE)
+        )
+        async for row in result:
+            count += 1
+            yield json.dumps(_listing_row(row, include_content), default=str, ensure_ascii=False) + "\n"
+
+    await log_action(
+        action_type="list",
+        resource_type="document",
+        request_data={"stream": True},
+        response_data={"count": count},
+        latency_ms=int((time.time() - start) * 1000),
+        status="success"
+    )
+
+async def search_knowledge_by_id(knowledge_id: str, replica: bool | None = None):
+    # Read-after-write safe: right after this process wrote documents it reads from the primary
+    async with get_read_session(("documents",), replica=replica) as session:
         result = await session.execute(select(Document).where(Document.id == knowledge_id))
         log = result.scalar_one_or_none()
 
@@ -214,27 +700,67 @@ async def search_knowledge_by_id(knowledge_id: str):
             "extra_info": log.extra_info,
         }
 
-async def search_similar(query_emb: list[float], k: int = 3, min_sim_score: float = 0.5):
-    async with get_session() as session:
-        try:
-            start = time.time()
-            query_embedding_str = json.dumps(query_emb)
-            q = text("""
-                SELECT id, content, 1 - (embedding <-> (:query_embedding_str)::vector) AS similarity
+def _candidate_count(k: int) -> int:
+    # Compact storage modes scan the index for more candidates and re-rank them exactly
+    return k if VECTOR_STORAGE_MODE == "full" else k * VECTOR_RERANK_FACTOR
+
+def _nearest_sql(metadata_sql: str = ""):
+    """
+    ORDER BY the index expression + LIMIT is what the ANN index can serve;
+    the similarity threshold is applied to those k rows afterwards.
+    Metadata filters stay inside so the index scan returns matching rows.
+    """
+    return text(f"""
+        SELECT id, content, similarity
+        FROM (
+            SELECT id, content, 1 - (embedding <=> (:query_embedding_str)::vector) AS similarity
+            FROM (
+                SELECT id, content, embedding
                 FROM documents
-                WHERE 1 - (embedding <-> (:query_embedding_str)::vector) > :min_sim_score
-                ORDER BY similarity DESC
-                LIMIT :k
-            """)
+                {"WHERE " + metadata_sql if metadata_sql else ""}
+                ORDER BY {_candidate_order()}
+                LIMIT :candidates
+            ) AS candidates
+            ORDER BY embedding <=> (:query_embedding_str)::vector
+            LIMIT :k
+        ) AS nearest
+        WHERE similarity > :min_sim_score
+        ORDER BY similarity DESC
+    """)
+
+async def _nearest_rows(session, query_emb: list[float], k: int, min_sim_score: float, metadata_sql: str, params: dict):
+    """
+    Run _nearest_sql at the current documents.embedding dimension. When the reindex swap
+    changed the column since the layout was last read, re-read it and retry once.
+    """
+    candidates = _candidate_count(k)
+    for attempt in (1, 2):
+        try:
+            await _set_search_params(session, candidates, filtered=bool(metadata_sql))
             result = await session.execute(
-                q,
+                _nearest_sql(metadata_sql),
                 {
-                    "query_embedding_str": query_embedding_str,
+                    "query_embedding_str": json.dumps(fit_dimension(query_emb, embedding_dims()[0])),
                     "min_sim_score": min_sim_score,
-                    "k": k
+                    "candidates": candidates,
+                    "k": k,
+                    **params
                 }
             )
-            rows = result.fetchall()
+            return result.fetchall()
+        except SQLAlchemyError:
+            if attempt == 2 or not await _layout_changed():
+                raise
+            await session.rollback()
+
+@timed("search.vector")
+async def search_similar(query_emb: list[float], k: int = 3, min_sim_score: float = 0.5, filters: dict | None = None,
+                         replica: bool | None = None):
+    async with get_read_session(("documents",), replica=replica) as session:
+        try:
+            start = time.time()
+            metadata_sql, params = _metadata_clause(filters)
+            rows = await _nearest_rows(session, query_emb, k, min_sim_score, metadata_sql, params)
 
             response_data = [
                 {
@@ -250,7 +776,8 @@ async def search_similar(query_emb: list[float], k: int = 3, min_sim_score: floa
                 resource_type="vector_store",
                 request_data={
                     "k": k,
-                    "min_sim_score": min_sim_score
+                    "min_sim_score": min_sim_score,
+                    "filters": filters
                 },
                 response_data={"results_count": len(response_data), "retrived_docs": response_data},
                 latency_ms=latency
@@ -263,7 +790,7 @@ async def search_similar(query_emb: list[float], k: int = 3, min_sim_score: floa
             await log_action(
                 action_type="search",
                 resource_type="vector_store",
-                request_data={"k": k, "min_sim_score": min_sim_score},
+                request_data={"k": k, "min_sim_score": min_sim_score, "filters": filters},
                 status="failed",
                 error_message=f"Database error: {str(e)}"
             )
@@ -274,8 +801,163 @@ async def search_similar(query_emb: list[float], k: int = 3, min_sim_score: floa
             await log_action(
                 action_type="search",
                 resource_type="vector_store",
-                request_data={"k": k, "min_sim_score": min_sim_score},
+                request_data={"k": k, "min_sim_score": min_sim_score, "filters": filters},
                 status="failed",
                 error_message=f"Unexpected error: {str(e)}"
             )
-            return {"status": "error", "message": f"Unexpected error: {str(e)}"}
\ No newline at end of file
+            return {"status": "error", "message": f"Unexpected error: {str(e)}"}
+
+@timed("search.lexical")
+async def search_lexical(query: str, k: int = 3, filters: dict | None = None, replica: bool | None = None):
+    """
+    Full-text search on the GIN-indexed content_tsv column. websearch_to_tsquery accepts
+    free text (quotes, OR, -term) and never raises on user input. Catches exact terms such as
+    error codes, SKUs or names that embeddings tend to blur.
+    """
+    async with get_read_session(("documents",), replica=replica) as session:
+        try:
+            start = time.time()
+            metadata_sql, params = _metadata_clause(filters)
+            q = text(f"""
+                SELECT id, content, ts_rank_cd(content_tsv, query) AS rank
+                FROM documents, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', :query) AS query
+                WHERE content_tsv @@ query {"AND " + metadata_sql if metadata_sql else ""}
+                ORDER BY rank DESC
+                LIMIT :k
+            """)
+            result = await session.execute(q, {"query": query, "k": k, **params})
+            response_data = [
+                {"id": r[0], "content": r[1], "rank": float(r[2])}
+                for r in result.fetchall()
+            ]
+            await log_action(
+                action_type="search",
+                resource_type="full_text",
+                request_data={"query": query, "k": k, "filters": filters},
+                response_data={"results_count": len(response_data)},
+                latency_ms=int((time.time() - start) * 1000)
+            )
+            return response_data
+
+        except SQLAlchemyError as e:
+            logger.error(f"Database error during full-text search: {e}")
+            await log_action(
+                action_type="search",
+                resource_type="full_text",
+                request_data={"query": query, "k": k, "filters": filters},
+                status="failed",
+                error_message=f"Database error: {str(e)}"
+            )
+            return {"status": "error", "message": f"Database error: {str(e)}"}
+
+        except Exception as e:
+            logger.error(f"Unexpected error during full-text search: {e}")
+            await log_action(
+                action_type="search",
+                resource_type="full_text",
+                request_data={"query": query, "k": k, "filters": filters},
+                status="failed",
+                error_message=f"Unexpected error: {str(e)}"
+            )
+            return {"status": "error", "message": f"Unexpected error: {str(e)}"}
+
+def reciprocal_rank_fusion(legs: list[tuple[list[dict], float]], k: int = 3, rrf_k: int = RRF_K) -> list[dict]:
+    """
+    Fuse ranked lists: score(d) = sum(weight / (rrf_k + rank of d in leg)).
+    Only ranks are used, so cosine similarities and ts_rank scores need no normalisation.
+    """
+    fused = {}
+    for docs, weight in legs:
+        for rank, doc in enumerate(docs, start=1):
+            entry = fused.setdefault(doc["id"], {"id": doc["id"], "content": doc["content"], "similarity": None, "score": 0.0})
+            entry["score"] += weight / (rrf_k + rank)
+            if doc.get("similarity") is not None:
+                entry["similarity"] = doc["similarity"]
+    return sorted(fused.values(), key=lambda d: d["score"], reverse=True)[:k]
+
+@timed("search.hybrid")
+async def search_hybrid(query: str, query_emb: list[float], k: int = 3, min_sim_score: float = 0.5,
+                        vector_k: int = HYBRID_VECTOR_K, lexical_k: int = HYBRID_LEXICAL_K,
+                        vector_weight: float = HYBRID_VECTOR_WEIGHT, lexical_weight: float = HYBRID_LEXICAL_WEIGHT,
+                        filters: dict | None = None, replica: bool | None = None):
+    """
+    Run the ANN and full-text legs concurrently (each on its own session/connection)
+    and fuse them with reciprocal rank fusion. min_sim_score only filters the vector leg,
+    so a literal match still gets in even when its embedding is not close.
+    A failing leg is logged and the other one is used alone.
+    """
+    start = time.time()
+    vector_docs, lexical_docs = await asyncio.gather(
+        search_similar(query_emb, k=vector_k, min_sim_score=min_sim_score, filters=filters, replica=replica),
+        search_lexical(query, k=lexical_k, filters=filters, replica=replica)
+    )
+    if isinstance(vector_docs, dict) and isinstance(lexical_docs, dict):
+        return vector_docs
+    legs = [
+        (docs, weight)
+        for docs, weight in ((vector_docs, vector_weight), (lexical_docs, lexical_weight))
+        if isinstance(docs, list)
+    ]
+    response_data = reciprocal_rank_fusion(legs, k=k)
+
+    await log_action(
+        action_type="search",
+        resource_type="hybrid",
+        request_data={
+            "k": k,
+            "vector_k": vector_k,
+            "lexical_k": lexical_k,
+            "vector_weight": vector_weight,
+            "lexical_weight": lexical_weight,
+            "filters": filters
+        },
+        response_data={"results_count": len(response_data), "retrived_docs": response_data},
+        latency_ms=int((time.time() - start) * 1000)
+    )
+    return response_data
+
+def validate_search_params(k, min_sim_score) -> tuple[int, float]:
+    """(k, min_sim_score) from request values; raises ValueError for wrong types or out-of-range values."""
+    if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= SEARCH_MAX_K:
+        raise ValueError(f"k must be an integer between 1 and {SEARCH_MAX_K}")
+    if isinstance(min_sim_score, bool) or not isinstance(min_sim_score, (int, float)) or not -1 <= min_sim_score <= 1:
+        raise ValueError("min_sim_score must be a number between -1 and 1")
+    return k, float(min_sim_score)
+
+async def search_knowledge(query: str, k: int = 3, min_sim_score: float = 0.5,
+                           filters: dict | None = None, mode: str = "vector",
+                           query_emb: list[float] | None = None):
+    """Retrieval without the LLM: top-k chunks for `query` in the given mode, restricted by metadata `filters`."""
+    if mode == "lexical":
+        return await search_lexical(query, k=k, filters=filters)
+    if query_emb is None:
+        query_emb = await get_embedding(query)
+    if mode == "hybrid":
+        return await search_hybrid(query, query_emb, k=k, min_sim_score=min_sim_score, filters=filters)
+    return await search_similar(query_emb, k=k, min_sim_score=min_sim_score, filters=filters)
+
+async def search_batch(queries: list[str], k: int = 3, min_sim_score: float = 0.5,
+                       filters: dict | None = None, mode: str = "vector", include_content: bool = True):
+    """
+    search_knowledge for many queries: embeddings come from one batched call, then the
+    lookups run concurrently on their own pooled connections, at most SEARCH_CONCURRENCY at once.
+    Results keep the order of `queries`; a failed lookup has an `error` instead of `hits`.
+    """
+    start = time.time()
+    semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
+    async def lookup(query: str, query_emb: list[float] | None) -> dict:
+        async with semaphore:
+            hits = await search_knowledge(query, k=k, min_sim_score=min_sim_score,
+                                          filters=filters, mode=mode, query_emb=query_emb)
+        if isinstance(hits, dict):
+            return {"query": query, "error": hits.get("message")}
+        if not include_content:
+            hits = [{key: value for key, value in hit.items() if key != "content"} for hit in hits]
+        return {"query": query, "hits": hits}
+
+    with timed("search.batch") as timer:
+        embeddings = [None] * len(queries) if mode == "lexical" else await get_query_embeddings(queries)
+        results = await asyncio.gather(*(lookup(q, emb) for q, emb in zip(queries, embeddings)))
+        timer.failed = any("error" in result for result in results)
+    return {"results": results, "latency_ms": int((time.time() - start) * 1000)}
@@ -0,0 +1,68 @@
+from sqlalchemy import text
+from loguru import logger
+from datetime import datetime, timezone
+from app.core.database import engine
+from app.services.embedding import get_embedder
+from app.services.chat import get_chat_model, get_graph
+import asyncio
+import time
+import os
+
+# Seconds a /health/ready database check may take before the instance reports not ready
+READINESS_DB_TIMEOUT = float(os.getenv("READINESS_DB_TIMEOUT", 2))
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", 5))
+
+_state = {"ready": False, "started_at": None, "finished_at": None, "seconds": None, "attempts": 0, "error": None}
+_task: asyncio.Task | None = None
+
+async def _ping_database():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+async def warm_up():
+    """
+    Build the clients and the chat graph and open a pooled database connection, so the
+    first request does not pay for them. /health/ready turns green once this is done.
+    Retried every WARMUP_RETRY_INTERVAL seconds while it fails (e.g. database still starting).
+    """
+    _state["started_at"] = datetime.now(timezone.utc)
+    start = time.time()
+    while True:
+        _state["attempts"] += 1
+        try:
+            # Client construction imports and configures the Google SDK: keep it off the event loop
+            await asyncio.to_thread(get_embedder)
+            await asyncio.to_thread(get_chat_model)
+            get_graph()
+            await _ping_database()
+            break
+        except Exception as e:
+            _state["error"] = str(e)
+            logger.warning(f"Warm-up failed, retrying in {WARMUP_RETRY_INTERVAL}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+    _state.update(ready=True, error=None, finished_at=datetime.now(timezone.utc), seconds=round(time.time() - start, 3))
+    logger.info(f"Warm-up done in {_state['seconds']}s")
+
+def start_warm_up():
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.create_task(warm_up(), name="warm-up")
+
+async def stop_warm_up():
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+
+async def readiness() -> tuple[bool, dict]:
+    """(ready, details): warm-up finished and the database answers within READINESS_DB_TIMEOUT."""
+    details = {"warm_up": dict(_state), "database": None}
+    if not _state["ready"]:
+        return False, details
+    try:
+        await asyncio.wait_for(_ping_database(), READINESS_DB_TIMEOUT)
+        details["database"] = "ok"
+    except Exception as e:
+        details["database"] = f"error: {e!r}"
+        return False, details
+    return True, details